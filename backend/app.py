@@ -1,30 +1,75 @@
 import sqlite3
 import os
-import shutil # New import for file moving
-from flask import Flask, request, jsonify, send_from_directory
+import io
+import json
+import stat
+import zipfile
+from flask import Flask, Blueprint, request, jsonify, send_file, g, abort, Response, stream_with_context
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-from database import init_db, get_db_connection # Assuming database.py is in the same directory
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import parse_content_range_header
+from werkzeug.security import safe_join
+from werkzeug.serving import is_running_from_reloader
+from database import ensure_schema, pool, transaction # Assuming database.py is in the same directory
+from resume_upload import (
+    ResumeUploadRequest, ChunkedUpload, MAX_RESUME_SIZE, MAX_CHUNK_SIZE, file_extension
+)
+import assessment_engine
+import bulk
+import job_queue
+import metrics
+import search
+import tasks # Registers the background job handlers
+from resume_store import UPLOAD_BASE_FOLDER, BLOBS_FOLDER, STAGING_FOLDER, blob_sha256, release_blob
+from file_cache import HotFileCache, DEFAULT_MAX_BYTES
 
-app = Flask(__name__)
-CORS(app) # Enable CORS for all routes
-
-# Base upload directory
-UPLOAD_BASE_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
-# Specific folders for categorization
-TEMP_RESUMES_FOLDER = os.path.join(UPLOAD_BASE_FOLDER, 'temp_resumes')
-QUALIFIED_RESUMES_FOLDER = os.path.join(UPLOAD_BASE_FOLDER, 'qualified_resumes')
-UNQUALIFIED_RESUMES_FOLDER = os.path.join(UPLOAD_BASE_FOLDER, 'unqualified_resumes')
+# All routes; create_app() registers them on the application
+api = Blueprint('api', __name__)
 
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx'}
 
-# Ensure all necessary upload folders exist
-os.makedirs(TEMP_RESUMES_FOLDER, exist_ok=True)
-os.makedirs(QUALIFIED_RESUMES_FOLDER, exist_ok=True)
-os.makedirs(UNQUALIFIED_RESUMES_FOLDER, exist_ok=True)
+# Largest request accepted by the bulk import (manifest plus zip of resumes)
+MAX_BULK_IMPORT_SIZE = 1024 * 1024 * 1024 # 1 GB
+
+# Resumes in the content-addressed store never change, so browsers may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# In-memory cache of small, frequently opened resumes (HOT_FILE_CACHE_BYTES=0 turns it off)
+file_cache = HotFileCache(int(os.environ.get('HOT_FILE_CACHE_BYTES', DEFAULT_MAX_BYTES)))
+
+# Recruiter listing pagination
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# SQL conditions for the recruiter listing's 'qualification' filter, based on the
+# category set from each student's latest assessment. Each is an equality on
+# category, so a filtered page is read from idx_students_category_created_at_id.
+QUALIFICATION_FILTERS = {
+    'qualified': "s.category = 'qualified'",
+    'unqualified': "s.category = 'unqualified'",
+    'unassessed': "s.category = 'pending'",
+}
+
+def get_db():
+    """
+    Returns the pooled database connection for the current request,
+    acquiring one on first use. It is handed back by release_db().
+    """
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+def release_db(exception):
+    """Returns the request's connection to the pool (rolling back anything uncommitted)."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+def discard_unclaimed_uploads(exception):
+    """Deletes uploaded files that the handler did not keep (e.g. on validation errors)."""
+    request.discard_uploads()
 
-# Initialize the database when the app starts
-init_db()
+@api.app_errorhandler(413)
+def request_too_large(error):
+    return jsonify({"success": False, "message": f"Resume is too large. The limit is {MAX_RESUME_SIZE // (1024 * 1024)} MB."}), 413
 
 def allowed_file(filename):
     """
@@ -35,170 +80,399 @@ def allowed_file(filename):
 
 # API Endpoints
 
-@app.route('/api/students', methods=['POST'])
+@api.route('/api/students', methods=['POST'])
 def add_student():
     """
     Endpoint to add a new student and upload their resume.
-    Initially saves resumes to the temporary folder.
-    Expects FormData with 'firstName', 'lastName', and 'resume' file.
+    Resumes are kept in the content-addressed store, so identical files are stored once.
+    Expects FormData with 'firstName', 'lastName', and either a 'resume' file or the
+    'uploadId' of a completed resumable upload (see /api/resume_uploads).
+    The resume is streamed to disk and hashed while the request is read, and its
+    type is checked from its leading bytes, not just its extension.
     """
-    if 'resume' not in request.files:
-        return jsonify({"success": False, "message": "No resume file part"}), 400
-
-    file = request.files['resume']
     first_name = request.form.get('firstName')
     last_name = request.form.get('lastName')
+    upload_id = request.form.get('uploadId')
+    conn = get_db()
+
+    if upload_id:
+        resume = ChunkedUpload.load(conn, STAGING_FOLDER, upload_id)
+        if resume is None:
+            return jsonify({"success": False, "message": "Upload not found"}), 404
+        if not resume.complete:
+            return jsonify({"success": False, "message": "Upload is not complete"}), 409
+        original_filename = resume.filename
+    else:
+        if 'resume' not in request.files:
+            return jsonify({"success": False, "message": "No resume file part"}), 400
 
-    if file.filename == '':
-        return jsonify({"success": False, "message": "No selected file"}), 400
+        file = request.files['resume']
+        if file.filename == '':
+            return jsonify({"success": False, "message": "No selected file"}), 400
+        original_filename = file.filename
+        resume = file.stream # A StreamingResume, already written to the temporary folder
 
     if not first_name or not last_name:
         return jsonify({"success": False, "message": "First name and last name are required"}), 400
 
-    if file and allowed_file(file.filename):
-        # Generate a unique filename to prevent conflicts and save to the temporary folder
-        # Uses first_name, last_name, and a random hex string for uniqueness
-        filename = secure_filename(f"{first_name}_{last_name}_{os.urandom(8).hex()}{os.path.splitext(file.filename)[1]}")
-        absolute_temp_path = os.path.join(TEMP_RESUMES_FOLDER, filename)
-        file.save(absolute_temp_path)
+    if not allowed_file(original_filename):
+        return jsonify({"success": False, "message": "File type not allowed. Only PDF, DOC, DOCX."}), 400
 
-        # Store the relative path from the UPLOAD_BASE_FOLDER in the database
-        relative_resume_path = os.path.join('temp_resumes', filename)
+    # Don't trust the extension alone: the file must actually be what it claims to be.
+    # A completed upload is hashed again here, before the write lock is taken.
+    try:
+        file_type = resume.verify() if upload_id else resume.file_type
+    except FileNotFoundError:
+        # Claimed by another request since it was loaded
+        return jsonify({"success": False, "message": "Upload not found or already used"}), 404
+    if file_type != file_extension(original_filename):
+        return jsonify({"success": False, "message": "File contents do not match its type. Only PDF, DOC, DOCX."}), 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                "INSERT INTO students (first_name, last_name, resume_path) VALUES (?, ?, ?)",
-                (first_name, last_name, relative_resume_path) # Storing relative path for tracking
+    try:
+        with transaction(conn):
+            # Resumes are stored once per distinct content, under their hash,
+            # however many students share them
+            relative_resume_path = resume.claim(conn)
+            if relative_resume_path is None:
+                # A double-submitted form: the other request claimed the upload first
+                return jsonify({"success": False, "message": "Upload not found or already used"}), 404
+            cursor = conn.execute(
+                "INSERT INTO students (first_name, last_name, resume_path, resume_sha256) VALUES (?, ?, ?, ?)",
+                (first_name, last_name, relative_resume_path, resume.sha256) # Storing relative path for tracking
             )
             student_id = cursor.lastrowid
-            conn.commit()
-            return jsonify({
-                "success": True,
-                "message": "Student added successfully to temp folder",
-                "studentId": student_id,
-                "resumePath": f"/files/{relative_resume_path}" # URL for client to potentially access resume
-            }), 201
-        except sqlite3.Error as e:
-            conn.rollback()
-            return jsonify({"success": False, "message": f"Database error: {e}"}), 500
-        finally:
-            conn.close()
-    else:
+            # Make the student searchable by name and resume contents
+            job_queue.enqueue(conn, 'index_resume', {"studentId": student_id})
+        job_queue.notify()
+        return jsonify({
+            "success": True,
+            "message": "Student added successfully",
+            "studentId": student_id,
+            "resumePath": f"/files/{relative_resume_path}" # URL for client to potentially access resume
+        }), 201
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+
+@api.route('/api/students/<int:student_id>', methods=['DELETE'])
+def delete_student(student_id):
+    """
+    Endpoint to remove a student along with their assessments and search index entry.
+    Their resume is deleted from the store once no other student shares it.
+    """
+    conn = get_db()
+    try:
+        with transaction(conn):
+            student = conn.execute("SELECT resume_sha256 FROM students WHERE id = ?", (student_id,)).fetchone()
+            if student is None:
+                return jsonify({"success": False, "message": "Student not found"}), 404
+            conn.execute("DELETE FROM assessments WHERE student_id = ?", (student_id,))
+            conn.execute("DELETE FROM student_search WHERE rowid = ?", (student_id,))
+            conn.execute("DELETE FROM students WHERE id = ?", (student_id,))
+            # Resumes not yet migrated into the store have no hash and are left in place
+            if student['resume_sha256']:
+                release_blob(conn, student['resume_sha256'])
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    return jsonify({"success": True, "message": "Student deleted", "studentId": student_id}), 200
+
+@api.route('/api/resume_uploads', methods=['POST'])
+def create_resume_upload():
+    """
+    Starts a resumable upload for a large resume.
+    Expects JSON with 'filename' and 'size' (in bytes). The file is then sent in
+    order with PUT /api/resume_uploads/<uploadId>, one chunk per request, and
+    the finished upload is attached to a student by passing 'uploadId' to /api/students.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Expected a JSON object"}), 400
+    filename = data.get('filename')
+    size = data.get('size')
+
+    if not filename or not isinstance(size, int) or size <= 0:
+        return jsonify({"success": False, "message": "filename and a positive size are required"}), 400
+    if not allowed_file(filename):
         return jsonify({"success": False, "message": "File type not allowed. Only PDF, DOC, DOCX."}), 400
+    if size > MAX_RESUME_SIZE:
+        return request_too_large(None)
+
+    conn = get_db()
+    try:
+        with transaction(conn):
+            upload = ChunkedUpload.create(conn, STAGING_FOLDER, filename, size)
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    return jsonify({
+        "success": True,
+        "uploadId": upload.id,
+        "offset": upload.received,
+        "size": upload.size,
+        "maxChunkSize": MAX_CHUNK_SIZE
+    }), 201
+
+@api.route('/api/resume_uploads/<upload_id>', methods=['GET'])
+def get_resume_upload(upload_id):
+    """Reports how much of a resumable upload has been received, so a client can resume it."""
+    upload = ChunkedUpload.load(get_db(), STAGING_FOLDER, upload_id)
+    if upload is None:
+        return jsonify({"success": False, "message": "Upload not found"}), 404
+    return jsonify({
+        "success": True,
+        "uploadId": upload.id,
+        "offset": upload.received,
+        "size": upload.size,
+        "complete": upload.complete
+    }), 200
+
+@api.route('/api/resume_uploads/<upload_id>', methods=['PUT'])
+def put_resume_upload_chunk(upload_id):
+    """
+    Receives the next chunk of a resumable upload as the raw request body.
+    Requires a 'Content-Range: bytes <start>-<end>/<size>' header whose start is
+    the upload's current offset; otherwise responds 409 with the offset to resume from.
+    """
+    conn = get_db()
+    upload = ChunkedUpload.load(conn, STAGING_FOLDER, upload_id)
+    if upload is None:
+        return jsonify({"success": False, "message": "Upload not found"}), 404
+
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if not isinstance(content_range, ContentRange) or content_range.units != 'bytes' \
+            or content_range.length != upload.size:
+        return jsonify({"success": False, "message": f"Content-Range must be 'bytes <start>-<end>/{upload.size}'"}), 400
+
+    length = content_range.stop - content_range.start
+    if length > MAX_CHUNK_SIZE:
+        return jsonify({"success": False, "message": f"Chunks may be at most {MAX_CHUNK_SIZE} bytes"}), 413
+    if request.content_length != length:
+        return jsonify({"success": False, "message": "Content-Length does not match Content-Range"}), 400
+    if content_range.start != upload.received:
+        return jsonify({"success": False, "message": "Chunk does not start at the current offset", "offset": upload.received}), 409
+
+    try:
+        with transaction(conn):
+            reserved = upload.reserve(conn)
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    if not reserved:
+        # e.g. a retry of a chunk whose first attempt is still being received
+        return jsonify({"success": False, "message": "Another chunk of this upload is being received, retry shortly"}), 409
 
-@app.route('/api/assessments', methods=['POST'])
+    appended = False
+    try:
+        appended = upload.append(request.stream, length)
+    finally:
+        if not appended:
+            with transaction(conn):
+                upload.release(conn)
+    if not appended:
+        return jsonify({"success": False, "message": "Chunk was incomplete", "offset": upload.received}), 400
+    try:
+        with transaction(conn):
+            saved = upload.save(conn)
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    if not saved:
+        # The lease ran out and another request took the upload over
+        return jsonify({"success": False, "message": "Upload offset changed, retry from the current offset"}), 409
+    if upload.complete and upload.file_type != file_extension(upload.filename):
+        return jsonify({"success": False, "message": "File contents do not match its type. Only PDF, DOC, DOCX."}), 400
+
+    return jsonify({
+        "success": True,
+        "uploadId": upload.id,
+        "offset": upload.received,
+        "size": upload.size,
+        "complete": upload.complete
+    }), 200
+
+@api.route('/api/question_sets/<version>', methods=['GET'])
+def get_question_set(version):
+    """
+    Returns a question set for the assessment UI to walk through.
+    'current' is the version new assessments are scored against.
+    """
+    if version == 'current':
+        version = assessment_engine.CURRENT_QUESTION_SET_VERSION
+    try:
+        question_set = assessment_engine.load_question_set(version)
+    except assessment_engine.QuestionSetError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    return jsonify(question_set.definition)
+
+@api.route('/api/assessments', methods=['POST'])
 def add_assessment():
     """
-    Endpoint to record an assessment score for a student and move their resume
-    based on the 'yes_answers_count':
-    - If yes_answers_count > 0, resume moves to 'qualified_resumes'.
-    - If yes_answers_count <= 0, resume moves to 'unqualified_resumes'.
+    Endpoint to record an assessment for a student.
+    Expects JSON with 'studentId' and 'answers' ({question id: option text}),
+    and optionally 'questionSetVersion' (the current one by default). The
+    answers are scored on the server against that question set; the client
+    never supplies the score.
+    The student is categorized from the score along with the assessment:
+    - If yes_answers_count > 0, the student is marked 'qualified'.
+    - If yes_answers_count <= 0, or the answers hit an early exit, the student is marked 'unqualified'.
+    Responds 201 with the score and the category.
     """
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Expected a JSON object"}), 400
     student_id = data.get('studentId')
-    yes_answers_count = data.get('yesAnswersCount') # This is the crucial score
-    total_possible_yes = data.get('totalPossibleYes') # Keep for context, but not for direct moving logic
-    assessment_message = data.get('assessmentMessage')
+    answers = data.get('answers')
+    question_set_version = data.get('questionSetVersion') or assessment_engine.CURRENT_QUESTION_SET_VERSION
 
-    if not all([student_id, yes_answers_count is not None, total_possible_yes is not None, assessment_message]):
-        return jsonify({"success": False, "message": "Missing required assessment data"}), 400
+    if student_id is None or answers is None:
+        return jsonify({"success": False, "message": "studentId and answers are required"}), 400
+    # bool is an int subclass, but true/false are not ids
+    if not isinstance(student_id, int) or isinstance(student_id, bool):
+        return jsonify({"success": False, "message": "studentId must be an integer"}), 400
+    if not isinstance(answers, dict) or not all(isinstance(answer, str) for answer in answers.values()):
+        return jsonify({"success": False, "message": "answers must map question ids to answer texts"}), 400
+    if not isinstance(question_set_version, str):
+        return jsonify({"success": False, "message": "questionSetVersion must be a string"}), 400
+    try:
+        result = assessment_engine.score_answers(assessment_engine.load_question_set(question_set_version), answers)
+    except assessment_engine.QuestionSetError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except assessment_engine.AnswerError as e:
+        return jsonify({"success": False, "message": f"Incomplete assessment: {e}"}), 400
+    yes_answers_count = result.score
+    total_possible_yes = result.total_possible
+    assessment_message = result.message
+    category = result.category
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    conn = get_db()
     try:
-        # First, insert the assessment record into the database
-        cursor.execute(
-            "INSERT INTO assessments (student_id, yes_answers_count, total_possible_yes, assessment_message) VALUES (?, ?, ?, ?)",
-            (student_id, yes_answers_count, total_possible_yes, assessment_message)
-        )
-        assessment_id = cursor.lastrowid
-
-        # Retrieve the current resume path for the student
-        cursor.execute("SELECT resume_path FROM students WHERE id = ?", (student_id,))
-        # Fetchone() returns None if no row, or a Row object/tuple if found.
-        # Assuming row_factory is set to sqlite3.Row, it can be accessed like a dict.
-        student_row = cursor.fetchone()
-        current_relative_resume_path = student_row['resume_path'] if student_row else None
-
-
-        if current_relative_resume_path:
-            old_absolute_path = os.path.join(UPLOAD_BASE_FOLDER, current_relative_resume_path)
-
-            # RESUME CATEGORIZATION LOGIC
-            if yes_answers_count > 0:
-                destination_folder_name = 'qualified_resumes'
-                destination_absolute_folder = QUALIFIED_RESUMES_FOLDER
-            else: # yes_answers_count <= 0
-                destination_folder_name = 'unqualified_resumes'
-                destination_absolute_folder = UNQUALIFIED_RESUMES_FOLDER
-
-            # Extract just the filename (e.g., 'my_resume.pdf' from 'temp_resumes/my_resume.pdf')
-            filename = os.path.basename(current_relative_resume_path)
-            new_absolute_path = os.path.join(destination_absolute_folder, filename)
-            new_relative_resume_path = os.path.join(destination_folder_name, filename)
-
-            if os.path.exists(old_absolute_path): # Ensure the file exists before attempting to move
-                shutil.move(old_absolute_path, new_absolute_path) # Move the file
-                # Update the student's resume_path in the database to reflect its new location
-                cursor.execute(
-                    "UPDATE students SET resume_path = ? WHERE id = ?",
-                    (new_relative_resume_path, student_id)
-                )
-                conn.commit() # Commit changes to the database
-                message = f"Assessment recorded and resume moved to {destination_folder_name}."
-                print(message)
-            else:
-                message = "Assessment recorded, but resume file not found for moving."
-                print(f"Warning: {message} Path: {old_absolute_path}")
-        else:
-            message = "Assessment recorded, but no resume path found for student."
-            print(f"Warning: {message} Student ID: {student_id}")
+        # The assessment and the student's category are committed together, or not at all
+        with transaction(conn):
+            cursor = conn.execute(
+                "UPDATE students SET category = ? WHERE id = ?", (category, student_id)
+            )
+            if cursor.rowcount == 0:
+                return jsonify({"success": False, "message": "Student not found"}), 404
+            cursor = conn.execute(
+                """
+                INSERT INTO assessments
+                    (student_id, yes_answers_count, total_possible_yes, assessment_message, question_set_version, answers)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (student_id, yes_answers_count, total_possible_yes, assessment_message,
+                 question_set_version, json.dumps(answers))
+            )
+            assessment_id = cursor.lastrowid
 
-        conn.commit() # Ensure all database operations for this request are committed
-        return jsonify({"success": True, "message": message, "assessmentId": assessment_id}), 201
+        return jsonify({
+            "success": True,
+            "message": f"Assessment recorded and resume categorized as {category}.",
+            "assessmentId": assessment_id,
+            "yesAnswersCount": yes_answers_count,
+            "totalPossibleYes": total_possible_yes,
+            "assessmentMessage": assessment_message,
+            "category": category,
+            "questionSetVersion": question_set_version
+        }), 201
     except sqlite3.Error as e:
-        conn.rollback() # Rollback in case of database error
+        # The transaction has already been rolled back
         return jsonify({"success": False, "message": f"Database error: {e}"}), 500
-    except Exception as e: # Catch any other unexpected errors (e.g., file system errors)
-        conn.rollback() # Still roll back if a file operation error occurs after DB insert
-        return jsonify({"success": False, "message": f"Server error during file move or assessment: {e}"}), 500
-    finally:
-        conn.close() # Always close the database connection
 
-@app.route('/api/students_with_assessments', methods=['GET'])
+@api.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Reports the progress of a background job: 'queued', 'running', 'done' or 'failed',
+    along with its attempts so far, last error and result.
+    """
+    job = job_queue.get_job(get_db(), job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({
+        "success": True,
+        "jobId": job['id'],
+        "kind": job['kind'],
+        "status": job['status'],
+        "attempts": job['attempts'],
+        "lastError": job['last_error'],
+        "result": json.loads(job['result']) if job['result'] else None,
+        "createdAt": job['created_at'],
+        "updatedAt": job['updated_at']
+    }), 200
+
+@api.route('/api/students_with_assessments', methods=['GET'])
 def get_students_with_assessments():
     """
-    Endpoint for recruiters to access: Retrieves all students
-    and their latest assessment results. Returns the relative path.
+    Endpoint for recruiters to access: Retrieves students and their latest
+    assessment results, newest first, one page at a time. Returns the relative path.
+
+    Query parameters (all optional):
+    - after: cursor of the form '<created_at>,<id>' taken from a previous page's 'nextCursor'
+    - limit: page size (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE)
+    - qualification: 'qualified', 'unqualified' or 'unassessed'
+    - from / to: only students created at or after 'from' and before 'to'
+      (e.g. '2025-06-01' or '2025-06-01 12:00:00')
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"success": False, "message": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    conditions = []
+    params = []
+
+    after = request.args.get('after')
+    if after:
+        # Keyset cursor: continue strictly after the last row of the previous page.
+        # Row-value comparison lets SQLite seek into idx_students_created_at_id
+        # (or idx_students_category_created_at_id when filtering by qualification).
+        cursor_created_at, _, cursor_id = after.rpartition(',')
+        if not cursor_created_at or not cursor_id.isdigit():
+            return jsonify({"success": False, "message": "after must be '<created_at>,<id>'"}), 400
+        conditions.append("(s.created_at, s.id) < (?, ?)")
+        params.extend([cursor_created_at, int(cursor_id)])
+
+    qualification = request.args.get('qualification')
+    if qualification:
+        if qualification not in QUALIFICATION_FILTERS:
+            return jsonify({"success": False, "message": f"qualification must be one of: {', '.join(QUALIFICATION_FILTERS)}"}), 400
+        conditions.append(QUALIFICATION_FILTERS[qualification])
 
-    query = """
+    if request.args.get('from'):
+        conditions.append("s.created_at >= ?")
+        params.append(request.args['from'])
+    if request.args.get('to'):
+        conditions.append("s.created_at < ?")
+        params.append(request.args['to'])
+
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # The latest assessment is found through students.latest_assessment_id (kept
+    # current by a trigger), so each page costs O(limit) instead of ranking
+    # the whole assessments table.
+    query = f"""
         SELECT
             s.id AS student_id,
             s.first_name,
             s.last_name,
-            s.resume_path, -- This will now contain the categorized path
+            s.resume_path, -- Path of the resume in the content-addressed store
+            s.category,
             s.created_at AS student_created_at,
             a.yes_answers_count,
             a.total_possible_yes,
             a.assessment_message,
             a.assessed_at AS assessment_assessed_at
         FROM students s
-        LEFT JOIN (
-            SELECT
-                *,
-                ROW_NUMBER() OVER(PARTITION BY student_id ORDER BY assessed_at DESC) as rn
-            FROM assessments
-        ) a ON s.id = a.student_id AND a.rn = 1
-        ORDER BY s.created_at DESC;
-    """
-    cursor.execute(query)
+        LEFT JOIN assessments a ON a.id = s.latest_assessment_id
+        {where_clause}
+        ORDER BY s.created_at DESC, s.id DESC
+        LIMIT ?;
+    """
+    # Fetch one extra row to know whether another page exists
+    params.append(limit + 1)
+
+    cursor = get_db().execute(query, params)
     students_data = cursor.fetchall()
-    conn.close()
+
+    has_more = len(students_data) > limit
+    students_data = students_data[:limit]
 
     results = []
     for row in students_data:
@@ -210,19 +484,284 @@ def get_students_with_assessments():
             student['resume_url'] = None # Or a placeholder URL if resume path is missing
         results.append(student)
 
-    return jsonify(results), 200
+    next_cursor = None
+    if has_more:
+        last = results[-1]
+        next_cursor = f"{last['student_created_at']},{last['student_id']}"
+
+    return jsonify({"students": results, "nextCursor": next_cursor}), 200
+
+@api.route('/api/search', methods=['GET'])
+def search_students():
+    """
+    Endpoint for recruiters to search students by name and resume contents.
+    Results are ranked by relevance (BM25, with name matches weighted above
+    resume text) and come with a snippet of the resume with the matching
+    words wrapped in <mark> tags.
+
+    Query parameters:
+    - q: words to search for; all must match, the last one also as a prefix
+    - after: cursor taken from a previous page's 'nextCursor'
+    - limit: page size (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE)
+    - qualification: 'qualified', 'unqualified' or 'unassessed'
+    """
+    match = search.match_expression(request.args.get('q', ''))
+    if match is None:
+        return jsonify({"success": False, "message": "q must contain at least one word"}), 400
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"success": False, "message": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    conditions = ["student_search MATCH ?"]
+    params = [match]
+
+    after = request.args.get('after')
+    if after:
+        # Keyset cursor on (rank, id); ranks are negative, best first
+        cursor_rank, _, cursor_id = after.rpartition(',')
+        try:
+            cursor_rank = float(cursor_rank)
+        except ValueError:
+            cursor_id = ''
+        if not cursor_id.isdigit():
+            return jsonify({"success": False, "message": "after must be '<rank>,<id>'"}), 400
+        conditions.append(f"({search.RANK_EXPRESSION}, s.id) > (?, ?)")
+        params.extend([cursor_rank, int(cursor_id)])
+
+    qualification = request.args.get('qualification')
+    if qualification:
+        if qualification not in QUALIFICATION_FILTERS:
+            return jsonify({"success": False, "message": f"qualification must be one of: {', '.join(QUALIFICATION_FILTERS)}"}), 400
+        conditions.append(QUALIFICATION_FILTERS[qualification])
+
+    query = f"""
+        SELECT
+            s.id AS student_id,
+            s.first_name,
+            s.last_name,
+            s.resume_path,
+            s.category,
+            s.created_at AS student_created_at,
+            {search.RANK_EXPRESSION} AS rank,
+            snippet(student_search, 2, ?, ?, '…', ?) AS snippet
+        FROM student_search
+        JOIN students s ON s.id = student_search.rowid
+        WHERE {' AND '.join(conditions)}
+        ORDER BY rank, s.id
+        LIMIT ?;
+    """
+    params = [search.MATCH_START, search.MATCH_END, search.SNIPPET_TOKENS] + params + [limit + 1]
+
+    try:
+        rows = get_db().execute(query, params).fetchall()
+    except sqlite3.OperationalError as e:
+        return jsonify({"success": False, "message": f"Invalid search: {e}"}), 400
+
+    has_more = len(rows) > limit
+    results = []
+    for row in rows[:limit]:
+        student = dict(row)
+        student['snippet'] = search.highlight(student['snippet'] or '')
+        student['resume_url'] = f"/files/{student['resume_path']}"
+        results.append(student)
+
+    next_cursor = None
+    if has_more:
+        last = results[-1]
+        next_cursor = f"{last['rank']!r},{last['student_id']}"
+
+    return jsonify({"results": results, "nextCursor": next_cursor}), 200
+
+@api.route('/api/bulk/referrals', methods=['POST'])
+def bulk_import_referrals():
+    """
+    Imports a batch of referrals, e.g. after a career fair.
+    Expects FormData with a 'manifest' file (.csv with a header row, or .jsonl)
+    and a 'resumes' zip file. Each manifest row has first_name, last_name and
+    resume (a file name inside the zip), and optionally answers (a JSON object
+    of question id -> answer text) and question_set_version to record an
+    assessment too, scored on the server like /api/assessments.
+    Rows are inserted in batched transactions; invalid rows are skipped and
+    listed in the response's 'errors'.
+    """
+    manifest = request.files.get('manifest')
+    resumes = request.files.get('resumes')
+    if not manifest or not resumes:
+        return jsonify({"success": False, "message": "A manifest file and a resumes zip are required"}), 400
+
+    manifest_format = file_extension(manifest.filename)
+    if manifest_format not in bulk.MANIFEST_FORMATS:
+        return jsonify({"success": False, "message": "Manifest must be a .csv or .jsonl file"}), 400
+
+    try:
+        with zipfile.ZipFile(resumes.stream) as resumes_zip:
+            summary = bulk.import_referrals(get_db(), bulk.read_manifest(manifest.stream, manifest_format), resumes_zip)
+    except zipfile.BadZipFile:
+        return jsonify({"success": False, "message": "resumes must be a zip file"}), 400
+    except bulk.ManifestError as e:
+        # Batches before the unreadable part of the manifest are already committed
+        summary = e.summary or {'imported': 0, 'assessed': 0, 'errors': []}
+        job_queue.notify()
+        return jsonify({
+            "success": False,
+            "message": f"{e}. Imported {summary['imported']} students and {summary['assessed']} assessments before the error.",
+            "imported": summary['imported'],
+            "assessed": summary['assessed'],
+            "errors": summary['errors']
+        }), 400
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    job_queue.notify() # Index the imported resumes
+
+    return jsonify({
+        "success": True,
+        "message": f"Imported {summary['imported']} students and {summary['assessed']} assessments.",
+        "imported": summary['imported'],
+        "assessed": summary['assessed'],
+        "errors": summary['errors']
+    }), 201 if summary['imported'] else 200
+
+bulk_import_referrals.accepts_any_file = True
+bulk_import_referrals.max_content_length = MAX_BULK_IMPORT_SIZE
+
+@api.route('/api/students_with_assessments/export', methods=['GET'])
+def export_students_with_assessments():
+    """
+    Streams every student with their latest assessment, as NDJSON (default)
+    or CSV (?format=csv), without loading the whole result set into memory.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in bulk.EXPORT_FORMATS:
+        return jsonify({"success": False, "message": f"format must be one of: {', '.join(bulk.EXPORT_FORMATS)}"}), 400
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    # stream_with_context keeps the request (and its pooled connection) alive until the last row is sent
+    response = Response(stream_with_context(bulk.export_students(get_db(), export_format)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="students_with_assessments.{export_format}"'
+    return response
 
 # Generic endpoint to serve files from any subfolder within UPLOAD_BASE_FOLDER
-@app.route('/files/<path:filepath>')
+@api.route('/files/<path:filepath>')
 def serve_file(filepath):
     """
     Serves files from any subfolder within the UPLOAD_BASE_FOLDER.
-    Example URL: http://localhost:5000/files/qualified_resumes/my_resume.pdf
-    send_from_directory handles security against directory traversal attacks.
+    Example URL: http://localhost:5000/files/blobs/3f/a2/3fa2...9c.pdf
+    safe_join handles security against directory traversal attacks.
+    Uploads still being received are not served.
+
+    Responses carry a strong ETag and support If-None-Match (304) and Range
+    (206) requests. Resumes in the content-addressed store use their content
+    hash as ETag and are marked immutable; small files are served from the
+    in-memory hot-file cache.
     """
-    return send_from_directory(UPLOAD_BASE_FOLDER, filepath)
+    path = safe_join(UPLOAD_BASE_FOLDER, filepath)
+    if path is None:
+        abort(404)
+    # Checked on the normalized path, so 'blobs/../staging/...' can't reach it either
+    if os.path.commonpath([path, STAGING_FOLDER]) == STAGING_FOLDER:
+        abort(404)
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        abort(404)
+    if not stat.S_ISREG(file_stat.st_mode):
+        abort(404)
+
+    content_hash = blob_sha256(os.path.relpath(path, UPLOAD_BASE_FOLDER).replace(os.sep, '/'))
+    if content_hash:
+        etag, max_age = content_hash, IMMUTABLE_MAX_AGE
+    else:
+        # Files outside the store can change, so browsers revalidate them every time
+        etag, max_age = f"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}", None
+
+    # No need to read the file at all if the browser's copy is current
+    data = None if request.if_none_match.contains(etag) else file_cache.read(path, file_stat)
+    response = send_file(
+        io.BytesIO(data) if data is not None else path,
+        download_name=os.path.basename(path),
+        etag=etag,
+        last_modified=file_stat.st_mtime,
+        max_age=max_age,
+        conditional=True # 304 Not Modified and 206 Partial Content handling
+    )
+    if content_hash:
+        response.cache_control.immutable = True
+    # Werkzeug only announces range support on range responses; PDF viewers look for it up front
+    response.headers.setdefault('Accept-Ranges', 'bytes')
+    if response.status_code == 304:
+        file_cache.count('not_modified')
+    elif response.status_code == 206:
+        file_cache.count('partial')
+    return response
+
+@api.route('/api/file_cache/stats', methods=['GET'])
+def get_file_cache_stats():
+    """Reports hot-file cache hits, misses and evictions, and 304/206 responses served."""
+    return jsonify(file_cache.stats()), 200
+
+def _file_cache_events():
+    stats = file_cache.stats()
+    return {(event,): stats[event] for event in file_cache.counters}
+
+def _unfinished_jobs():
+    # Only statuses that stay small; finished jobs are kept and would make this a full scan
+    rows = get_db().execute(
+        "SELECT kind, status, COUNT(*) AS count FROM jobs WHERE status IN ('queued', 'running') GROUP BY kind, status"
+    ).fetchall()
+    return {(row['kind'], row['status']): row['count'] for row in rows}
+
+metrics.CallbackMetric('file_cache_events_total', "Hot-file cache events and conditional responses served.",
+                       'counter', ('event',), _file_cache_events)
+metrics.CallbackMetric('file_cache_bytes', "Bytes of resumes held in the hot-file cache.",
+                       'gauge', (), lambda: {(): file_cache.stats()['bytes']})
+metrics.CallbackMetric('jobs', "Background jobs waiting or running, by kind and status.",
+                       'gauge', ('kind', 'status'), _unfinished_jobs)
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Performance metrics of this server process in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def create_app(config=None):
+    """
+    Application factory: builds the Flask app with its settings, hooks and routes.
+    Nothing touches the database here, so a pre-fork server can build the app
+    once before forking its workers; the schema is checked (and created or
+    migrated if needed) once per process, before the first request is handled.
+    `config` overrides the default settings.
+    """
+    app = Flask(__name__)
+    app.request_class = ResumeUploadRequest # Stream uploaded resumes straight to disk
+    app.config['ALLOWED_EXTENSIONS'] = ALLOWED_EXTENSIONS
+    app.config['RESUME_UPLOAD_FOLDER'] = STAGING_FOLDER
+    # Reject oversized bodies before reading them (from Content-Length), or as soon
+    # as the limit is crossed for streamed bodies. Leaves room for the form fields.
+    app.config['MAX_CONTENT_LENGTH'] = MAX_RESUME_SIZE + 64 * 1024
+    if config:
+        app.config.update(config)
+
+    CORS(app) # Enable CORS for all routes
+    metrics.init_app(app) # Per-route latency and SQL timings, served at /metrics
+    app.before_request(ensure_schema)
+    app.teardown_request(discard_unclaimed_uploads)
+    app.teardown_appcontext(release_db)
+    app.register_blueprint(api)
+
+    # Ensure all necessary upload folders exist
+    os.makedirs(BLOBS_FOLDER, exist_ok=True)
+    os.makedirs(STAGING_FOLDER, exist_ok=True)
+    return app
 
 if __name__ == '__main__':
-    # When app.py is run directly, it will initialize the database and start the Flask server.
-    # Note: init_db() is also called globally, so this is a double call but harmless.
+    # Development server; see wsgi.py for running with several worker processes.
+    # Background jobs run in this process; with the debug reloader, only in the
+    # reloaded child that actually serves requests. Other setups can run
+    # `python tasks.py` as a separate worker process instead.
+    app = create_app()
+    if is_running_from_reloader():
+        job_queue.JobWorkerPool(int(os.environ.get('JOB_WORKERS', job_queue.DEFAULT_WORKERS))).start()
     app.run(debug=True, port=5001) # Ensure this matches your JavaScript's fetch URL port
@@ -0,0 +1,238 @@
+"""
+Server-side scoring of referral assessments.
+
+Question sets are versioned JSON files in question_sets/ (v1.json, v2.json, ...).
+Each is compiled once into an immutable decision tree: every question node
+holds its options keyed by answer text, and every option points straight at
+the next node, or ends the assessment (an early exit, or the last question).
+Scoring a submission walks a single path from the start question, so it costs
+one dictionary lookup per question asked. Compiled sets are cached by version.
+"""
+import argparse
+import functools
+import json
+import os
+import re
+from collections import namedtuple
+from types import MappingProxyType
+from database import ensure_schema, get_db_connection, transaction
+
+QUESTION_SETS_FOLDER = os.path.join(os.path.dirname(__file__), 'question_sets')
+# Version used for new assessments that don't name one
+CURRENT_QUESTION_SET_VERSION = os.environ.get('QUESTION_SET_VERSION', 'v1')
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Assessments re-scored per transaction by rescore_assessments()
+RESCORE_BATCH_SIZE = 500
+
+# A compiled question set. `questions` maps id -> Question; `max_score` is the
+# best total any path can reach (stored as the assessment's total_possible_yes).
+QuestionSet = namedtuple('QuestionSet', ['version', 'start', 'questions', 'results', 'max_score', 'definition'])
+Question = namedtuple('Question', ['id', 'text', 'options'])
+# `next` is the next Question, or None when the option ends the assessment
+Option = namedtuple('Option', ['text', 'score', 'next', 'early_exit', 'message'])
+AssessmentResult = namedtuple('AssessmentResult', ['score', 'total_possible', 'message', 'early_exit', 'path', 'category'])
+
+class QuestionSetError(ValueError):
+    """Raised when a question set doesn't exist or isn't a valid decision tree."""
+
+class AnswerError(ValueError):
+    """Raised when submitted answers don't complete a path through the question set."""
+
+def categorize(yes_answers_count):
+    """
+    RESUME CATEGORIZATION LOGIC
+    A positive score qualifies the student; zero or below does not.
+    Assessments ended by an early exit are unqualified whatever their score
+    (score_answers() sets their category).
+    """
+    return 'qualified' if yes_answers_count > 0 else 'unqualified'
+
+def available_versions():
+    """Returns the versions of the question sets on disk, sorted by name."""
+    return sorted(
+        name[:-len('.json')] for name in os.listdir(QUESTION_SETS_FOLDER)
+        if name.endswith('.json') and VERSION_PATTERN.match(name[:-len('.json')])
+    )
+
+@functools.lru_cache(maxsize=None)
+def load_question_set(version=CURRENT_QUESTION_SET_VERSION):
+    """
+    Returns the compiled question set for a version. Each version is read and
+    compiled once per process; edit a question set by adding a new version.
+    """
+    if not VERSION_PATTERN.match(version or ''):
+        raise QuestionSetError(f"Invalid question set version '{version}'")
+    path = os.path.join(QUESTION_SETS_FOLDER, f"{version}.json")
+    try:
+        with open(path, encoding='utf-8') as f:
+            definition = json.load(f)
+    except FileNotFoundError:
+        raise QuestionSetError(f"Unknown question set version '{version}'")
+    except json.JSONDecodeError as e:
+        raise QuestionSetError(f"Question set '{version}' is not valid JSON: {e}")
+    return compile_question_set(version, definition)
+
+def compile_question_set(version, definition):
+    """
+    Builds the decision tree for a question set definition, checking that every
+    nextQuestion exists, that no path loops back on itself and that early exits
+    carry a message. Questions that can't be reached from the start are dropped.
+    """
+    try:
+        by_id = {}
+        for question in definition['questions']:
+            if question['id'] in by_id:
+                raise QuestionSetError(f"Question set '{version}' has two questions with id '{question['id']}'")
+            by_id[question['id']] = question
+        start_id = definition.get('start') or definition['questions'][0]['id']
+        results = {category: definition['results'][category] for category in ('qualified', 'unqualified')}
+    except (KeyError, IndexError, TypeError) as e:
+        raise QuestionSetError(f"Question set '{version}' is missing {e}")
+
+    compiled = {}    # id -> Question
+    max_scores = {}  # id -> best score from that question to the end
+    in_progress = set()
+
+    def build(question_id):
+        # Depth-first, so each node is built after every node it points to
+        if question_id in compiled:
+            return compiled[question_id]
+        if question_id in in_progress:
+            raise QuestionSetError(f"Question set '{version}' loops back to question '{question_id}'")
+        if question_id not in by_id:
+            raise QuestionSetError(f"Question set '{version}' refers to unknown question '{question_id}'")
+        in_progress.add(question_id)
+
+        question = by_id[question_id]
+        options = {}
+        best = None
+        for option in question['options']:
+            early_exit = bool(option.get('endQuiz'))
+            if early_exit and not option.get('message'):
+                raise QuestionSetError(f"Early exit '{option['text']}' of question '{question_id}' in '{version}' needs a message")
+            next_question = None if early_exit or not option.get('nextQuestion') else build(option['nextQuestion'])
+            options[option['text']] = Option(option['text'], int(option['score']), next_question, early_exit, option.get('message'))
+            if not early_exit:
+                # Early exits never qualify (see score_answers), so only completed paths count towards the best score
+                reachable = int(option['score']) + (max_scores[next_question.id] if next_question else 0)
+                best = reachable if best is None else max(best, reachable)
+
+        in_progress.discard(question_id)
+        compiled[question_id] = Question(question_id, question['question'], MappingProxyType(options))
+        max_scores[question_id] = best if best is not None else 0
+        return compiled[question_id]
+
+    try:
+        build(start_id)
+    except QuestionSetError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise QuestionSetError(f"Question set '{version}' has a malformed question or option: {e}")
+    return QuestionSet(
+        version, compiled[start_id], MappingProxyType(compiled), MappingProxyType(results), max_scores[start_id], definition
+    )
+
+def score_answers(question_set, answers):
+    """
+    Scores answers ({question id: option text}) by walking the decision tree
+    from the start question. Only the questions on the path taken need an
+    answer; any others are ignored. Raises AnswerError if an answer is missing
+    or isn't one of the question's options.
+    An early exit ends the assessment as unqualified, whatever the score so far.
+    """
+    score = 0
+    path = []
+    question = question_set.start
+    while question is not None:
+        answer = answers.get(question.id)
+        if answer is None:
+            raise AnswerError(f"Missing answer to question '{question.id}'")
+        option = question.options.get(answer)
+        if option is None:
+            raise AnswerError(f"'{answer}' is not an answer to question '{question.id}'")
+        score += option.score
+        path.append(question.id)
+        if option.early_exit:
+            return AssessmentResult(score, question_set.max_score, option.message, True, tuple(path), 'unqualified')
+        question = option.next
+
+    category = categorize(score)
+    message = question_set.results[category].format(score=score)
+    return AssessmentResult(score, question_set.max_score, message, False, tuple(path), category)
+
+def rescore_assessments(conn, version, batch_size=RESCORE_BATCH_SIZE, dry_run=False):
+    """
+    Re-scores every assessment with recorded answers against a question set
+    version, updating its score, message and version in place, and the
+    student's category when it is their latest assessment.
+    Runs one transaction per batch, so it can be interrupted and re-run.
+    Returns counts of rescored, changed (category flipped) and failed
+    assessments; failed ones (answers that don't fit the new set) are left as they were.
+    """
+    question_set = load_question_set(version)
+    counts = {'rescored': 0, 'changed': 0, 'failed': 0, 'errors': []}
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT a.id, a.student_id, a.yes_answers_count, a.answers, s.latest_assessment_id
+            FROM assessments a
+            JOIN students s ON s.id = a.student_id
+            WHERE a.answers IS NOT NULL AND a.id > ?
+            ORDER BY a.id
+            LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return counts
+        last_id = rows[-1]['id']
+
+        assessment_updates = []
+        category_updates = []
+        for row in rows:
+            try:
+                result = score_answers(question_set, json.loads(row['answers']))
+            except (AnswerError, ValueError, AttributeError) as e:
+                counts['failed'] += 1
+                counts['errors'].append({'assessmentId': row['id'], 'message': str(e)})
+                continue
+            counts['rescored'] += 1
+            if result.category != categorize(row['yes_answers_count']):
+                counts['changed'] += 1
+            assessment_updates.append((result.score, result.total_possible, result.message, version, row['id']))
+            if row['latest_assessment_id'] == row['id']:
+                category_updates.append((result.category, row['student_id']))
+
+        if dry_run:
+            continue
+        with transaction(conn):
+            conn.executemany('''
+                UPDATE assessments
+                SET yes_answers_count = ?, total_possible_yes = ?, assessment_message = ?, question_set_version = ?
+                WHERE id = ?
+            ''', assessment_updates)
+            conn.executemany("UPDATE students SET category = ? WHERE id = ?", category_updates)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score assessments against versioned question sets.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    rescore_parser = subcommands.add_parser('rescore', help="re-score recorded answers against a question set version")
+    rescore_parser.add_argument('--version', default=CURRENT_QUESTION_SET_VERSION,
+                                help=f"question set version (default: {CURRENT_QUESTION_SET_VERSION})")
+    rescore_parser.add_argument('--batch-size', type=int, default=RESCORE_BATCH_SIZE,
+                                help=f"assessments per transaction (default: {RESCORE_BATCH_SIZE})")
+    rescore_parser.add_argument('--dry-run', action='store_true', help="report what would change without changing anything")
+    args = parser.parse_args()
+
+    ensure_schema()
+    conn = get_db_connection()
+    try:
+        counts = rescore_assessments(conn, args.version, args.batch_size, args.dry_run)
+    except QuestionSetError as e:
+        raise SystemExit(f"Error: {e}")
+    finally:
+        conn.close()
+    for error in counts['errors']:
+        print(f"Assessment {error['assessmentId']}: {error['message']}")
+    prefix = "Would rescore" if args.dry_run else "Rescored"
+    print(f"{prefix} {counts['rescored']} assessments against {args.version}; "
+          f"{counts['changed']} changed category, {counts['failed']} could not be scored.")
@@ -0,0 +1,185 @@
+"""
+Concurrency benchmark for the SQLite layer.
+
+Runs reader threads (the recruiter listing query) and writer threads
+(a student insert followed by an assessment insert) against a scratch
+database and reports throughput for two setups:
+
+- legacy: a new sqlite3.connect() per operation, rollback-journal mode,
+  the way the handlers used to work
+- pooled: database.pool connections, WAL mode and database.transaction()
+
+Usage:
+    python benchmarks/db_concurrency.py --readers 8 --writers 4 --duration 5
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Make the backend modules importable when run from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+LISTING_QUERY = """
+    SELECT s.id, s.first_name, s.last_name, s.resume_path, s.created_at,
+           a.yes_answers_count, a.total_possible_yes, a.assessment_message, a.assessed_at
+    FROM students s
+    LEFT JOIN assessments a ON a.id = s.latest_assessment_id
+    ORDER BY s.created_at DESC, s.id DESC
+    LIMIT 50
+"""
+
+def seed(path, students):
+    """Fills a fresh database with the given number of assessed students."""
+    database.init_db(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO students (first_name, last_name, resume_path) VALUES (?, ?, ?)",
+            ((f"First{i}", f"Last{i}", f"temp_resumes/seed_{i}.pdf") for i in range(students))
+        )
+        conn.execute("""
+            INSERT INTO assessments (student_id, yes_answers_count, total_possible_yes, assessment_message)
+            SELECT id, id % 3 - 1, 9, 'seeded' FROM students
+        """)
+    conn.close()
+
+def write_referral(conn, worker, n):
+    conn.execute(
+        "INSERT INTO students (first_name, last_name, resume_path) VALUES (?, ?, ?)",
+        (f"Bench{worker}", f"Writer{n}", f"temp_resumes/bench_{worker}_{n}.pdf")
+    )
+    student_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    conn.execute(
+        "INSERT INTO assessments (student_id, yes_answers_count, total_possible_yes, assessment_message) VALUES (?, ?, ?, ?)",
+        (student_id, 1, 9, 'benchmark')
+    )
+
+class LegacyBackend:
+    """A connection per operation and the default rollback journal."""
+
+    def __init__(self, path):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+
+    def read(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute(LISTING_QUERY).fetchall()
+        finally:
+            conn.close()
+
+    def write(self, worker, n):
+        conn = sqlite3.connect(self.path)
+        try:
+            write_referral(conn, worker, n)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+class PooledBackend:
+    """Pooled, tuned WAL connections with IMMEDIATE write transactions."""
+
+    def __init__(self, path):
+        self.pool = database.ConnectionPool(path, size=64)
+
+    def read(self):
+        conn = self.pool.acquire()
+        try:
+            conn.execute(LISTING_QUERY).fetchall()
+        finally:
+            self.pool.release(conn)
+
+    def write(self, worker, n):
+        conn = self.pool.acquire()
+        try:
+            with database.transaction(conn):
+                write_referral(conn, worker, n)
+        finally:
+            self.pool.release(conn)
+
+    def close(self):
+        self.pool.close_all()
+
+def run(backend, readers, writers, duration):
+    """Drives the backend from reader and writer threads for `duration` seconds."""
+    counts = {'reads': 0, 'writes': 0, 'read_errors': 0, 'write_errors': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def reader():
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                backend.read()
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        with lock:
+            counts['reads'] += done
+            counts['read_errors'] += errors
+
+    def writer(worker):
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                backend.write(worker, done + errors)
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        with lock:
+            counts['writes'] += done
+            counts['write_errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return counts, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8, help="reader threads (default: 8)")
+    parser.add_argument('--writers', type=int, default=4, help="writer threads (default: 4)")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per backend (default: 5)")
+    parser.add_argument('--students', type=int, default=20000, help="students to seed (default: 20000)")
+    parser.add_argument('--only', choices=['legacy', 'pooled'], help="run a single backend")
+    args = parser.parse_args()
+
+    backends = {'legacy': LegacyBackend, 'pooled': PooledBackend}
+    if args.only:
+        backends = {args.only: backends[args.only]}
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.duration:g}s each, {args.students} seeded students")
+    print(f"{'backend':<8} {'reads/s':>10} {'writes/s':>10} {'read errs':>10} {'write errs':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, backend_class in backends.items():
+            path = os.path.join(tmp, f"{name}.db")
+            seed(path, args.students)
+            backend = backend_class(path)
+            counts, elapsed = run(backend, args.readers, args.writers, args.duration)
+            backend.close()
+            print(f"{name:<8} {counts['reads'] / elapsed:>10.0f} {counts['writes'] / elapsed:>10.0f} "
+                  f"{counts['read_errors']:>10} {counts['write_errors']:>10}")
+
+if __name__ == '__main__':
+    main()
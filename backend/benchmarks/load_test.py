@@ -0,0 +1,376 @@
+"""
+Load test for the HTTP API.
+
+Seeds a scratch database and resume store with assessed students, their
+search index rows and synthetic PDF resumes, serves the app from a threaded
+server in this process, and drives a weighted mix of requests from concurrent
+clients:
+
+- list_students: GET /api/students_with_assessments (first page, sometimes filtered)
+- search: GET /api/search for a word found in the resumes
+- serve_resume: GET /files/<resume>
+- add_student: POST /api/students with a new resume
+- add_assessment: POST /api/assessments with answers along a random path
+
+Reports requests, errors, throughput and p50/p90/p99 latency per scenario,
+and the server's average SQL statements per request from /metrics.
+Save the results with --json and compare a later run against them with
+--baseline to catch regressions (the exit status is 1 if any are found).
+--url runs the same mix against an already running server instead.
+
+Usage:
+    python benchmarks/load_test.py --students 5000 --concurrency 16 --duration 20
+    python benchmarks/load_test.py --json baseline.json
+    python benchmarks/load_test.py --baseline baseline.json
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Make the backend modules importable when run from anywhere
+sys.path.insert(0, BACKEND_FOLDER)
+
+SCENARIO_WEIGHTS = {
+    'list_students': 30,
+    'search': 20,
+    'serve_resume': 25,
+    'add_student': 10,
+    'add_assessment': 15,
+}
+PERCENTILES = (50, 90, 99)
+
+# Words the synthetic resumes are made of, and that the search scenario looks for
+VOCABULARY = (
+    'python', 'java', 'javascript', 'sql', 'kubernetes', 'docker', 'react', 'flask', 'spark', 'hadoop',
+    'analytics', 'statistics', 'machine', 'learning', 'research', 'intern', 'teaching', 'assistant',
+    'leadership', 'hackathon', 'robotics', 'finance', 'marketing', 'cloud', 'security', 'compilers',
+    'databases', 'networks', 'graphics', 'algorithms', 'startup', 'volunteer', 'tutor', 'president',
+)
+FIRST_NAMES = ('Ada', 'Grace', 'Alan', 'Edsger', 'Barbara', 'Donald', 'Frances', 'Ken', 'Margaret', 'Dennis')
+LAST_NAMES = ('Lovelace', 'Hopper', 'Turing', 'Dijkstra', 'Liskov', 'Knuth', 'Allen', 'Thompson', 'Hamilton', 'Ritchie')
+
+def resume_text(rng, words):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words))
+
+def synthetic_pdf(text, size):
+    """A small, valid PDF with the text on one page, padded with a comment to about `size` bytes."""
+    content = f"BT /F1 11 Tf 72 720 Td ({text}) Tj ET".encode()
+    body = (
+        b"%PDF-1.4\n"
+        b"1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+        b"2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n"
+        b"3 0 obj << /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R >> endobj\n"
+        + f"4 0 obj << /Length {len(content)} >> stream\n".encode() + content + b"\nendstream endobj\n"
+    )
+    padding = max(0, size - len(body) - 6)
+    return body + b"%" + b"0" * padding + b"\n%%EOF\n"
+
+def random_answers(question_set, rng):
+    """Answers along a random path through a compiled question set."""
+    answers = {}
+    question = question_set.start
+    while question is not None:
+        option = rng.choice(list(question.options.values()))
+        answers[question.id] = option.text
+        question = None if option.early_exit else option.next
+    return answers
+
+def seed(students, resumes, resume_size, rng):
+    """
+    Fills the scratch database and resume store (set up through REFERRAL_GAME_DB
+    and REFERRAL_GAME_UPLOADS) with students sharing `resumes` distinct files.
+    """
+    import assessment_engine
+    import database
+    import resume_store
+
+    database.init_db()
+    question_set = assessment_engine.load_question_set()
+    blobs = []
+    for _ in range(resumes):
+        text = resume_text(rng, 200)
+        data = synthetic_pdf(text, resume_size)
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = resume_store.blob_absolute_path(resume_store.blob_relative_path(sha256, 'pdf'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        blobs.append((sha256, len(data), text))
+
+    conn = sqlite3.connect(database.DATABASE_PATH)
+    with conn:
+        conn.executemany(
+            "INSERT INTO resume_blobs (sha256, extension, size, ref_count) VALUES (?, 'pdf', ?, 0)",
+            ((sha256, size) for sha256, size, _ in blobs)
+        )
+        conn.executemany("INSERT INTO resume_texts (sha256, text) VALUES (?, ?)", ((sha256, text) for sha256, _, text in blobs))
+        rows = []
+        for i in range(students):
+            sha256, _, text = blobs[i % len(blobs)]
+            result = assessment_engine.score_answers(question_set, random_answers(question_set, rng))
+            rows.append((i + 1, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), sha256, text, result))
+        conn.executemany(
+            "INSERT INTO students (id, first_name, last_name, resume_path, resume_sha256, indexed_sha256, category) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((i, first, last, resume_store.blob_relative_path(sha256, 'pdf'), sha256, sha256, result.category)
+             for i, first, last, sha256, _, result in rows)
+        )
+        conn.execute("UPDATE resume_blobs SET ref_count = (SELECT COUNT(*) FROM students WHERE resume_sha256 = sha256)")
+        conn.executemany(
+            "INSERT INTO assessments (student_id, yes_answers_count, total_possible_yes, assessment_message, question_set_version) VALUES (?, ?, ?, ?, ?)",
+            ((i, result.score, result.total_possible, result.message, question_set.version) for i, _, _, _, _, result in rows)
+        )
+        conn.executemany(
+            "INSERT INTO student_search (rowid, first_name, last_name, resume_text) VALUES (?, ?, ?, ?)",
+            ((i, first, last, text) for i, first, last, _, text, _ in rows)
+        )
+    conn.close()
+
+def start_server(job_workers):
+    """Serves the app from a threaded server on a free port; returns its base URL."""
+    from werkzeug.serving import make_server
+    import app as backend
+    import job_queue
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # No line per request
+    server = make_server('127.0.0.1', 0, backend.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    job_queue.JobWorkerPool(job_workers).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+def request(method, url, body=None, headers=None):
+    """Sends a request and returns (status, body)."""
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def multipart(fields, files):
+    """Encodes form fields and (name, filename, data) files as multipart/form-data."""
+    boundary = os.urandom(16).hex()
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+class Scenarios:
+    """The requests the clients send, picked by weight."""
+
+    def __init__(self, base_url, resume_size):
+        import assessment_engine
+
+        self.base_url = base_url
+        self.resume_size = resume_size
+        self.question_set = assessment_engine.load_question_set()
+        # Targets for the read and assessment scenarios, taken from the server itself
+        status, body = request('GET', f"{base_url}/api/students_with_assessments?limit=200")
+        if status != 200:
+            raise SystemExit(f"Could not list students from {base_url}: HTTP {status}")
+        students = json.loads(body)['students']
+        if not students:
+            raise SystemExit(f"{base_url} has no students to test against; seed some first")
+        self.student_ids = [student['student_id'] for student in students]
+        self.resume_urls = [student['resume_url'] for student in students]
+        self.names = list(SCENARIO_WEIGHTS)
+        self.weights = list(SCENARIO_WEIGHTS.values())
+
+    def pick(self, rng):
+        return rng.choices(self.names, self.weights)[0]
+
+    def run(self, name, rng):
+        return getattr(self, name)(rng)
+
+    def list_students(self, rng):
+        query = '?limit=50' + rng.choice(('', '', '&qualification=qualified', '&qualification=unqualified'))
+        return request('GET', f"{self.base_url}/api/students_with_assessments{query}")[0]
+
+    def search(self, rng):
+        return request('GET', f"{self.base_url}/api/search?q={rng.choice(VOCABULARY)}&limit=20")[0]
+
+    def serve_resume(self, rng):
+        return request('GET', f"{self.base_url}{rng.choice(self.resume_urls)}")[0]
+
+    def add_student(self, rng):
+        pdf = synthetic_pdf(resume_text(rng, 200), self.resume_size)
+        body, headers = multipart(
+            {'firstName': rng.choice(FIRST_NAMES), 'lastName': rng.choice(LAST_NAMES)},
+            [('resume', 'resume.pdf', pdf)]
+        )
+        return request('POST', f"{self.base_url}/api/students", body, headers)[0]
+
+    def add_assessment(self, rng):
+        body = json.dumps({
+            'studentId': rng.choice(self.student_ids),
+            'questionSetVersion': self.question_set.version,
+            'answers': random_answers(self.question_set, rng),
+        }).encode()
+        return request('POST', f"{self.base_url}/api/assessments", body, {'Content-Type': 'application/json'})[0]
+
+def drive(scenarios, concurrency, duration, warmup, seed_value):
+    """Runs clients for warmup + duration seconds; returns latencies and errors per scenario for the measured part."""
+    latencies = {name: [] for name in SCENARIO_WEIGHTS}
+    errors = {name: 0 for name in SCENARIO_WEIGHTS}
+    lock = threading.Lock()
+    stop = threading.Event()
+    measure_from = time.perf_counter() + warmup
+
+    def client(worker):
+        rng = random.Random(seed_value * 1000 + worker)
+        own_latencies = {name: [] for name in SCENARIO_WEIGHTS}
+        own_errors = {name: 0 for name in SCENARIO_WEIGHTS}
+        while not stop.is_set():
+            name = scenarios.pick(rng)
+            started = time.perf_counter()
+            try:
+                status = scenarios.run(name, rng)
+            except OSError:
+                status = None
+            finished = time.perf_counter()
+            if started < measure_from:
+                continue
+            own_latencies[name].append(finished - started)
+            if status is None or status >= 400:
+                own_errors[name] += 1
+        with lock:
+            for name in SCENARIO_WEIGHTS:
+                latencies[name].extend(own_latencies[name])
+                errors[name] += own_errors[name]
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup + duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def summarize(latencies, errors, duration):
+    results = {}
+    everything = []
+    for name in SCENARIO_WEIGHTS:
+        values = sorted(latencies[name])
+        everything.extend(values)
+        results[name] = _summary(values, errors[name], duration)
+    results['total'] = _summary(sorted(everything), sum(errors.values()), duration)
+    return results
+
+def _summary(values, error_count, duration):
+    summary = {'requests': len(values), 'errors': error_count, 'throughput': len(values) / duration}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary[f"p{p}_ms"] = value * 1000 if value is not None else None
+    return summary
+
+def sql_statements_per_request(base_url):
+    """Average SQL statements per request by route, from the server's /metrics."""
+    status, body = request('GET', f"{base_url}/metrics")
+    if status != 200:
+        return {}
+    totals = {}
+    pattern = re.compile(r'^referral_game_http_request_sql_statements_(sum|count)\{route="([^"]*)"\} (\S+)$')
+    for line in body.decode().splitlines():
+        match = pattern.match(line)
+        if match:
+            totals.setdefault(match.group(2), {})[match.group(1)] = float(match.group(3))
+    return {route: values['sum'] / values['count'] for route, values in totals.items() if values.get('count')}
+
+def compare(results, baseline, tolerance):
+    """Returns a description of each scenario whose p99 latency or throughput got worse than the baseline allows."""
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before or not before['requests'] or not current['requests']:
+            continue
+        if current['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {before['p99_ms']:.1f} ms -> {current['p99_ms']:.1f} ms")
+        if current['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: {before['throughput']:.0f} -> {current['throughput']:.0f} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=5000, help="students to seed (default: 5000)")
+    parser.add_argument('--resumes', type=int, default=500, help="distinct resume files to seed (default: 500)")
+    parser.add_argument('--resume-size', type=int, default=64 * 1024, help="bytes per synthetic resume (default: 65536)")
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent clients (default: 16)")
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds measured (default: 20)")
+    parser.add_argument('--warmup', type=float, default=2.0, help="seconds run before measuring (default: 2)")
+    parser.add_argument('--job-workers', type=int, default=2, help="background job workers in the server (default: 2)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed, for repeatable runs (default: 1)")
+    parser.add_argument('--url', help="test an already running server (e.g. http://localhost:5001) instead of seeding one")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--baseline', help="results file of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed p99 increase / throughput drop against the baseline (default: 0.25)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            # Must be set before the backend modules are imported
+            os.environ['REFERRAL_GAME_DB'] = os.path.join(tmp, 'load_test.db')
+            os.environ['REFERRAL_GAME_UPLOADS'] = os.path.join(tmp, 'uploads')
+            started = time.perf_counter()
+            seed(args.students, args.resumes, args.resume_size, random.Random(args.seed))
+            print(f"Seeded {args.students} students and {args.resumes} resumes in {time.perf_counter() - started:.1f}s")
+            base_url = start_server(args.job_workers)
+
+        scenarios = Scenarios(base_url, args.resume_size)
+        print(f"{args.concurrency} clients, {args.duration:g}s after {args.warmup:g}s warmup, against {base_url}")
+        latencies, errors = drive(scenarios, args.concurrency, args.duration, args.warmup, args.seed)
+        results = summarize(latencies, errors, args.duration)
+        sql_per_request = sql_statements_per_request(base_url)
+
+    print(f"{'scenario':<16} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}")
+    for name, summary in results.items():
+        timings = ' '.join(f"{summary[f'p{p}_ms']:>8.1f}" if summary[f'p{p}_ms'] is not None else f"{'-':>8}" for p in PERCENTILES)
+        print(f"{name:<16} {summary['requests']:>9} {summary['errors']:>7} {summary['throughput']:>8.1f} {timings}")
+    if sql_per_request:
+        print("\nSQL statements per request (server side, including warmup):")
+        for route, average in sorted(sql_per_request.items()):
+            print(f"  {route:<48} {average:>6.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results, 'sql_statements_per_request': sql_per_request}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+if __name__ == '__main__':
+    main()
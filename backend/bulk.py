@@ -0,0 +1,292 @@
+import argparse
+import csv
+import io
+import json
+import shutil
+import sys
+import zipfile
+from werkzeug.exceptions import RequestEntityTooLarge
+import assessment_engine
+from database import ensure_schema, get_db_connection, transaction
+import job_queue
+from resume_store import STAGING_FOLDER
+from resume_upload import StreamingResume, MAX_RESUME_SIZE, STREAM_CHUNK_SIZE, file_extension
+
+# Referrals inserted per transaction during an import
+IMPORT_BATCH_SIZE = 500
+# Rows fetched from SQLite (and written out) at a time during an export
+EXPORT_BATCH_SIZE = 500
+
+MANIFEST_FORMATS = ('csv', 'jsonl')
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# Columns of a manifest row. The assessment columns are optional: answers
+# ({question id: option text}, as JSON) are scored by assessment_engine
+# against question_set_version (the current one by default).
+MANIFEST_COLUMNS = ('first_name', 'last_name', 'resume', 'answers', 'question_set_version')
+# Precomputed scores, accepted by earlier versions; rows with them are rejected
+# rather than imported without their assessment
+SCORE_COLUMNS = ('yes_answers_count', 'total_possible_yes', 'assessment_message')
+
+EXPORT_QUERY = """
+    SELECT
+        s.id AS student_id,
+        s.first_name,
+        s.last_name,
+        s.resume_path,
+        s.category,
+        s.created_at AS student_created_at,
+        a.yes_answers_count,
+        a.total_possible_yes,
+        a.assessment_message,
+        a.assessed_at AS assessment_assessed_at
+    FROM students s
+    LEFT JOIN assessments a ON a.id = s.latest_assessment_id
+    ORDER BY s.id
+"""
+EXPORT_COLUMNS = (
+    'student_id', 'first_name', 'last_name', 'resume_path', 'category', 'student_created_at',
+    'yes_answers_count', 'total_possible_yes', 'assessment_message', 'assessment_assessed_at'
+)
+
+class ManifestError(ValueError):
+    """
+    Raised when a manifest can't be read at all (as opposed to a bad row).
+    Batches before the point where reading failed are already imported;
+    `summary` reports them (see import_referrals).
+    """
+    summary = None
+
+def read_manifest(stream, manifest_format):
+    """
+    Yields (line number, row) for each referral in a CSV (with a header row)
+    or JSON Lines manifest read from a binary stream. Rows are dicts for CSV
+    and the undecoded JSON text for JSON Lines.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        if manifest_format == 'csv':
+            reader = csv.DictReader(text)
+            if not reader.fieldnames or not {'first_name', 'last_name', 'resume'} <= set(reader.fieldnames):
+                raise ManifestError("CSV manifest needs a header row with first_name, last_name and resume")
+            for row in reader:
+                yield reader.line_num, row
+        elif manifest_format == 'jsonl':
+            # Lines are decoded by _parse_row, so one bad line only skips that referral
+            for line_number, line in enumerate(text, start=1):
+                if line.strip():
+                    yield line_number, line
+        else:
+            raise ManifestError(f"Manifest format must be one of: {', '.join(MANIFEST_FORMATS)}")
+    except UnicodeDecodeError:
+        raise ManifestError("Manifest must be UTF-8 encoded")
+    finally:
+        text.detach() # Leave closing the underlying stream to its owner
+
+def _parse_row(row):
+    """Validates a manifest row and returns it normalized, or raises ValueError."""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"not valid JSON: {e}")
+        if not isinstance(row, dict):
+            raise ValueError("not a JSON object")
+    values = {column: row.get(column) for column in MANIFEST_COLUMNS}
+    for column in ('first_name', 'last_name', 'resume'):
+        if not values[column] or not str(values[column]).strip():
+            raise ValueError(f"{column} is required")
+        values[column] = str(values[column]).strip()
+    if any(row.get(column) not in (None, '') for column in SCORE_COLUMNS):
+        raise ValueError("scores are not accepted; give the assessment as answers")
+
+    answers = values['answers']
+    if answers in (None, ''):
+        values['assessment'] = None # Not assessed yet
+        return values
+    if isinstance(answers, str): # A JSON object in a CSV cell
+        try:
+            answers = json.loads(answers)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"answers is not valid JSON: {e}")
+    if not isinstance(answers, dict) or not all(isinstance(answer, str) for answer in answers.values()):
+        raise ValueError("answers must map question ids to answer texts")
+    values['answers'] = answers
+    values['question_set_version'] = str(values['question_set_version'] or assessment_engine.CURRENT_QUESTION_SET_VERSION)
+    # QuestionSetError and AnswerError are ValueErrors, so they skip just this row
+    question_set = assessment_engine.load_question_set(values['question_set_version'])
+    values['assessment'] = assessment_engine.score_answers(question_set, answers)
+    return values
+
+def _stage_resume(resumes_zip, name):
+    """Streams a resume out of the zip into the staging folder, hashing and sniffing it."""
+    try:
+        info = resumes_zip.getinfo(name)
+    except KeyError:
+        raise ValueError(f"resume '{name}' is not in the zip")
+    if file_extension(name) not in ('pdf', 'doc', 'docx'):
+        raise ValueError(f"resume '{name}' is not a PDF, DOC or DOCX")
+    if info.file_size > MAX_RESUME_SIZE:
+        raise ValueError(f"resume '{name}' is larger than {MAX_RESUME_SIZE // (1024 * 1024)} MB")
+
+    resume = StreamingResume(STAGING_FOLDER)
+    try:
+        with resumes_zip.open(info) as member:
+            shutil.copyfileobj(member, resume, STREAM_CHUNK_SIZE)
+        resume.close() # Don't hold a file handle per staged resume until the batch is written
+    except RequestEntityTooLarge:
+        resume.discard()
+        raise ValueError(f"resume '{name}' is larger than {MAX_RESUME_SIZE // (1024 * 1024)} MB")
+    except (zipfile.BadZipFile, OSError) as e:
+        resume.discard()
+        raise ValueError(f"resume '{name}' could not be read: {e}")
+    if resume.file_type != file_extension(name):
+        resume.discard()
+        raise ValueError(f"resume '{name}' contents do not match its type")
+    return resume
+
+def _insert_batch(conn, staged):
+    """
+    Inserts a batch of validated referrals with staged resumes in one transaction.
+    Returns how many of them had an assessment.
+    """
+    with transaction(conn):
+        student_rows = []
+        for values, resume in staged:
+            assessment = values['assessment']
+            category = assessment.category if assessment is not None else 'pending'
+            student_rows.append((values['first_name'], values['last_name'], resume.claim(conn), resume.sha256, category))
+        conn.executemany(
+            "INSERT INTO students (first_name, last_name, resume_path, resume_sha256, category) VALUES (?, ?, ?, ?, ?)",
+            student_rows
+        )
+        # The write lock is held for the whole transaction and students uses
+        # AUTOINCREMENT, so the batch received consecutive ids ending at the last one
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        first_id = last_id - len(student_rows) + 1
+
+        assessment_rows = [
+            (first_id + i, values['assessment'].score, values['assessment'].total_possible, values['assessment'].message,
+             values['question_set_version'], json.dumps(values['answers']))
+            for i, (values, _) in enumerate(staged)
+            if values['assessment'] is not None
+        ]
+        conn.executemany(
+            """
+            INSERT INTO assessments
+                (student_id, yes_answers_count, total_possible_yes, assessment_message, question_set_version, answers)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            assessment_rows
+        )
+        # Resume text extraction for the search index happens in the background
+        job_queue.enqueue_many(conn, 'index_resume', [{"studentId": first_id + i} for i in range(len(student_rows))])
+    return len(assessment_rows)
+
+def import_referrals(conn, manifest_rows, resumes_zip, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports referrals from manifest rows (see read_manifest) whose resumes are
+    members of `resumes_zip` (a zipfile.ZipFile).
+    Valid rows are inserted IMPORT_BATCH_SIZE at a time with executemany, one
+    transaction per batch; invalid rows are skipped and reported.
+    Returns a summary with the number of students and assessments imported and
+    a list of row errors. If the manifest becomes unreadable partway through,
+    the ManifestError raised carries the summary of what was imported before.
+    """
+    summary = {'imported': 0, 'assessed': 0, 'errors': []}
+    staged = []
+
+    def flush():
+        try:
+            summary['assessed'] += _insert_batch(conn, staged)
+            summary['imported'] += len(staged)
+        finally:
+            for _, resume in staged:
+                resume.discard() # Removes staged files of a batch that failed
+            staged.clear()
+
+    try:
+        for line_number, row in manifest_rows:
+            try:
+                values = _parse_row(row)
+                staged.append((values, _stage_resume(resumes_zip, values['resume'])))
+            except ValueError as e:
+                summary['errors'].append({'line': line_number, 'message': str(e)})
+                continue
+            if len(staged) >= batch_size:
+                flush()
+        if staged:
+            flush()
+    except ManifestError as e:
+        e.summary = summary # Earlier batches are committed; report them with the error
+        raise
+    finally:
+        for _, resume in staged:
+            resume.discard() # Resumes staged for a batch that was never inserted
+    return summary
+
+def export_students(conn, export_format):
+    """
+    Yields the students with their latest assessments as NDJSON or CSV text,
+    EXPORT_BATCH_SIZE rows at a time, without holding the full result in memory.
+    """
+    cursor = conn.execute(EXPORT_QUERY)
+    cursor.arraysize = EXPORT_BATCH_SIZE
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            writer.writerows(tuple(row) for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield ''.join(json.dumps(dict(row)) + '\n' for row in rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk import and export of referrals.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subcommands.add_parser('import', help="import referrals from a manifest and a zip of resumes")
+    import_parser.add_argument('manifest', help=f"CSV or JSON Lines manifest with columns: {', '.join(MANIFEST_COLUMNS)}")
+    import_parser.add_argument('resumes', help="zip file containing the resumes named in the manifest")
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                               help=f"referrals per transaction (default: {IMPORT_BATCH_SIZE})")
+
+    export_parser = subcommands.add_parser('export', help="write all students with their latest assessment to stdout")
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+
+    args = parser.parse_args()
+
+    ensure_schema()
+    conn = get_db_connection()
+    try:
+        if args.command == 'import':
+            manifest_format = file_extension(args.manifest)
+            with open(args.manifest, 'rb') as manifest, zipfile.ZipFile(args.resumes) as resumes_zip:
+                summary = import_referrals(conn, read_manifest(manifest, manifest_format), resumes_zip, args.batch_size)
+            for error in summary['errors']:
+                print(f"Line {error['line']}: {error['message']}", file=sys.stderr)
+            print(f"Imported {summary['imported']} students and {summary['assessed']} assessments; "
+                  f"{len(summary['errors'])} rows skipped.")
+        else:
+            for chunk in export_students(conn, args.format):
+                sys.stdout.write(chunk)
+    except ManifestError as e:
+        if e.summary and e.summary['imported']:
+            print(f"Imported {e.summary['imported']} students and {e.summary['assessed']} assessments before the error.")
+        sys.exit(f"Error: {e}")
+    except zipfile.BadZipFile as e:
+        sys.exit(f"Error: {e}")
+    finally:
+        conn.close()
@@ -1,14 +1,74 @@
 import sqlite3
 import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from metrics import TimedConnection
 
 DATABASE_NAME = 'referral_game.db'
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), DATABASE_NAME)
+# REFERRAL_GAME_DB overrides the location (e.g. for benchmarks or a scratch copy)
+DATABASE_PATH = os.environ.get('REFERRAL_GAME_DB', os.path.join(os.path.dirname(__file__), DATABASE_NAME))
 
-def init_db():
-    """Initializes the SQLite database with necessary tables."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+# Per-connection tuning. WAL itself is persistent and is switched on by init_db().
+BUSY_TIMEOUT_MS = 5000
+CONNECTION_PRAGMAS = (
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",  # Safe with WAL; fsync only at checkpoints
+    "PRAGMA cache_size = -16000",   # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456", # Memory-map up to 256 MB of the database file
+    "PRAGMA temp_store = MEMORY",
+)
 
+# Bounded exponential backoff for writers that still find the database busy
+# after busy_timeout (e.g. under heavy write contention)
+WRITE_RETRIES = 5
+WRITE_RETRY_BASE_DELAY = 0.05 # seconds, doubled on every attempt
+WRITE_RETRY_MAX_DELAY = 1.0
+
+# Idle connections kept by the pool; extra connections are closed on release
+POOL_SIZE = 8
+
+# Version of the schema built by init_db(), stored in the database file as
+# PRAGMA user_version. Bump it whenever init_db() changes, so existing
+# databases are migrated once instead of re-running the DDL on every start.
+SCHEMA_VERSION = 4
+# How long a process waits for another one that is migrating the schema
+SCHEMA_LOCK_TIMEOUT = 60 # seconds
+
+# Databases whose schema has been checked by this process
+_checked_schemas = set()
+_schema_lock = threading.Lock()
+
+def init_db(path=None):
+    """
+    Initializes the SQLite database with necessary tables, or migrates an older one.
+    Runs as one IMMEDIATE transaction that re-reads the schema version once it
+    holds the write lock, so when several processes start at once, one of them
+    migrates and the others find it done. Returns True if anything was changed.
+    """
+    # Transactions are managed explicitly here, DDL included
+    conn = sqlite3.connect(path or DATABASE_PATH, timeout=SCHEMA_LOCK_TIMEOUT, isolation_level=None)
+    try:
+        # Write-ahead logging lets recruiters keep reading while referrals are written.
+        # The journal mode is stored in the database file and can't be changed inside a transaction.
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return False
+        _create_schema(conn.cursor())
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    finally:
+        conn.close() # Rolls back anything left uncommitted
+    # On stderr, so a command writing data to stdout (e.g. bulk.py export) isn't corrupted
+    print(f"Database initialized at {path or DATABASE_PATH}", file=sys.stderr)
+    return True
+
+def _create_schema(cursor):
+    """Creates the tables, or adds whatever an older database is missing."""
     # Create students table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS students (
@@ -33,16 +93,271 @@ def init_db():
         )
     ''')
 
-    conn.commit()
-    conn.close()
-    print(f"Database initialized at {DATABASE_PATH}")
+    # Pointer to each student's latest assessment, so the recruiter listing can
+    # join a single row instead of ranking every assessment on every request.
+    # Older databases are migrated in place and backfilled once.
+    if _add_column(cursor, 'students', 'latest_assessment_id', 'INTEGER REFERENCES assessments(id)'):
+        cursor.execute('''
+            UPDATE students SET latest_assessment_id = (
+                SELECT a.id FROM assessments a
+                WHERE a.student_id = students.id
+                ORDER BY a.assessed_at DESC, a.id DESC
+                LIMIT 1
+            )
+        ''')
+
+    # Keep the pointer current: the newest assessment for a student is always
+    # the one just inserted.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS assessments_set_latest
+        AFTER INSERT ON assessments
+        BEGIN
+            UPDATE students SET latest_assessment_id = NEW.id WHERE id = NEW.student_id;
+        END
+    ''')
+
+    # SHA-256 of the resume contents, computed while the upload is streamed to disk
+    _add_column(cursor, 'students', 'resume_sha256', 'TEXT')
+
+    # Whether the student qualified, from their latest assessment:
+    # 'pending' (not assessed yet), 'qualified' or 'unqualified'.
+    # Older databases are backfilled once from the assessments.
+    if _add_column(cursor, 'students', 'category', "TEXT NOT NULL DEFAULT 'pending'"):
+        cursor.execute('''
+            UPDATE students SET category = (
+                SELECT CASE WHEN a.yes_answers_count > 0 THEN 'qualified' ELSE 'unqualified' END
+                FROM assessments a WHERE a.id = students.latest_assessment_id
+            )
+            WHERE latest_assessment_id IS NOT NULL
+        ''')
+
+    # Assessments scored on the server: the question set version used and the
+    # answers given ({question id: option text}, as JSON), so they can be re-scored
+    _add_column(cursor, 'assessments', 'question_set_version', 'TEXT')
+    _add_column(cursor, 'assessments', 'answers', 'TEXT')
+
+    # Full-text search (see search.py): text extracted from each distinct resume,
+    # and an FTS5 index with one row per student (rowid = students.id)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resume_texts (
+            sha256 TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS student_search USING fts5(
+            first_name, last_name, resume_text,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+    ''')
+    # Hash of the resume whose text is in the student's index row, so re-indexing only touches changed resumes
+    _add_column(cursor, 'students', 'indexed_sha256', 'TEXT')
+
+    # Content-addressed resume files, shared by every student whose resume has the same contents
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resume_blobs (
+            sha256 TEXT PRIMARY KEY,
+            extension TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Resumable (chunked) resume uploads in progress
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resume_uploads (
+            id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            sha256 TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Lease of the request writing the next chunk (see ChunkedUpload.reserve)
+    _add_column(cursor, 'resume_uploads', 'locked_until', 'TIMESTAMP')
+
+    # Durable background jobs (see job_queue.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued', -- queued, running, done or failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            locked_until TIMESTAMP,
+            last_error TEXT,
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after)")
+    # Assessments no longer queue a follow-up job; drop any left from before, which no worker handles
+    cursor.execute("DELETE FROM jobs WHERE kind = 'categorize_resume' AND status IN ('queued', 'running')")
+
+    # Keyset pagination index for the recruiter listing (newest first)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_created_at_id ON students(created_at, id)")
+    # The same order within each category, for the listing's qualification filter
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_category_created_at_id ON students(category, created_at, id)")
+    # Per-student assessment lookups (backfill, history)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_assessments_student_assessed_at ON assessments(student_id, assessed_at)")
+
+def ensure_schema(path=None):
+    """
+    Makes sure the database has the current schema, running init_db() only if
+    it is new or older than SCHEMA_VERSION. Checked once per process, so it is
+    cheap to call before any unit of work.
+    Raises RuntimeError if the database was created by newer code.
+    """
+    path = path or DATABASE_PATH
+    if path in _checked_schemas:
+        return
+    with _schema_lock:
+        if path in _checked_schemas:
+            return
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Database {path} has schema version {version}, newer than this code's {SCHEMA_VERSION}"
+            )
+        if version < SCHEMA_VERSION:
+            init_db(path) # Serialized between processes by its own write transaction
+        _checked_schemas.add(path)
+
+def _add_column(cursor, table, column, definition):
+    """Adds a column to an existing table unless it is already there. Returns True if it was added."""
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
 
-def get_db_connection():
-    """Returns a database connection."""
-    conn = sqlite3.connect(DATABASE_PATH)
+def get_db_connection(path=None):
+    """Returns a new, tuned database connection. The caller is responsible for closing it."""
+    # check_same_thread is off so pooled connections can be handed to whichever
+    # thread serves the next request; a connection is only ever used by one thread at a time.
+    # TimedConnection records statement timings for /metrics.
+    conn = sqlite3.connect(
+        path or DATABASE_PATH, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, factory=TimedConnection
+    )
     conn.row_factory = sqlite3.Row # This allows accessing columns by name
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+class ConnectionPool:
+    """
+    Keeps a bounded set of open, tuned connections so requests don't pay for
+    sqlite3.connect() and pragma setup every time.
+    Use acquire() at the start of a unit of work and release() when done.
+    """
+
+    def __init__(self, path=None, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size) # LIFO keeps the warmest connection in use
+
+    def acquire(self):
+        """Returns an idle connection, or opens a new one if none are available."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return get_db_connection(self.path)
+
+    def release(self, conn):
+        """Returns a connection to the pool, discarding any unfinished transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def forget_all(self):
+        """
+        Drops every idle connection without closing it. For a forked child: SQLite
+        connections must not be used across fork(), and closing the parent's copies
+        could release file locks the parent still holds.
+        """
+        self._idle = queue.LifoQueue(maxsize=self._idle.maxsize)
+
+pool = ConnectionPool()
+# Worker processes forked by a pre-fork server start with an empty pool
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=pool.forget_all)
+
+def _is_busy_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+@contextmanager
+def transaction(conn):
+    """
+    Runs a block of writes as one IMMEDIATE transaction: commits on success,
+    rolls back on any exception.
+    Taking the write lock up front avoids deadlocking with another writer halfway
+    through the block; if the lock is still busy after busy_timeout, acquiring
+    it is retried with bounded exponential backoff.
+    File changes that go with the block's writes register on_commit() and
+    on_rollback() callbacks, so the disk follows whichever way it ends.
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if not _is_busy_error(e) or attempt == WRITE_RETRIES:
+                raise
+            delay = min(WRITE_RETRY_BASE_DELAY * (2 ** attempt), WRITE_RETRY_MAX_DELAY)
+            time.sleep(delay * random.uniform(0.5, 1.0)) # Jitter so retries don't collide again
+    conn.commit_callbacks, conn.rollback_callbacks = [], []
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        # Undo in reverse order, while this connection still holds the write lock
+        _run_callbacks(reversed(conn.rollback_callbacks))
+        conn.rollback()
+        raise
+    finally:
+        callbacks = conn.commit_callbacks
+        conn.commit_callbacks = conn.rollback_callbacks = None
+    _run_callbacks(callbacks)
+
+def on_commit(conn, callback):
+    """Calls `callback` once the transaction in progress on `conn` has committed."""
+    conn.commit_callbacks.append(callback)
+
+def on_rollback(conn, callback):
+    """
+    Calls `callback` if the transaction in progress on `conn` rolls back,
+    before its write lock is released.
+    """
+    conn.rollback_callbacks.append(callback)
+
+def _run_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except OSError as e: # Don't hide the outcome of the transaction itself
+            print(f"Warning: could not finish a transaction's file changes: {e}")
+
 if __name__ == '__main__':
     # Running this file directly will initialize the database
     init_db()
\ No newline at end of file
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from metrics import timed
+
+# Total size of the files kept in memory (0 turns the cache off)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024 # 64 MB
+# Files larger than this are always streamed from disk
+DEFAULT_MAX_FILE_SIZE = 1024 * 1024 # 1 MB
+
+class HotFileCache:
+    """
+    Bounded, thread-safe LRU of small files' contents, so resumes that are
+    opened over and over are served without reading them from disk each time.
+    Entries are keyed by path and validated against the file's modification
+    time and size, so a changed file is never served stale.
+    Counts hits, misses, evictions and the conditional/range responses served.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_file_size=DEFAULT_MAX_FILE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self._entries = OrderedDict() # path -> (mtime_ns, size, data)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'uncacheable': 0,   # Too large (or cache disabled): streamed from disk
+            'not_modified': 0,  # 304 responses
+            'partial': 0,       # 206 (range) responses
+        }
+
+    def read(self, path, stat):
+        """
+        Returns the contents of the file at `path` (whose os.stat() result is
+        `stat`) from memory, reading and caching it on a miss. Returns None if
+        the file is too large to cache, in which case the caller streams it.
+        """
+        if stat.st_size > self.max_file_size or stat.st_size > self.max_bytes:
+            self.count('uncacheable')
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                self._entries.move_to_end(path)
+                self.counters['hits'] += 1
+                return entry[2]
+            self.counters['misses'] += 1
+
+        with timed('file_read'), open(path, 'rb') as f:
+            data = f.read()
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= len(old[2])
+            self._entries[path] = (stat.st_mtime_ns, stat.st_size, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.counters['evictions'] += 1
+        return data
+
+    def count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
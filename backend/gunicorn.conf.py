@@ -0,0 +1,49 @@
+"""
+gunicorn settings for serving the API with several worker processes:
+
+    cd backend
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden with the usual environment variables below
+or on the command line.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+# SQLite allows one writer at a time, so more processes than cores only add
+# lock contention; threads cover requests waiting on uploads and disk.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+# Import the app once in the master: workers are forked with everything
+# loaded, so starting or replacing one is quick. Safe because building the
+# app opens no database connections.
+preload_app = True
+# Replace workers now and then to bound memory growth; the jitter keeps
+# them from all restarting at once
+max_requests = int(os.environ.get('MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+# Large resume uploads from slow connections
+timeout = 120
+graceful_timeout = 30
+
+# Background job workers per web worker (0 to run them only with `python tasks.py`)
+job_workers = int(os.environ.get('JOB_WORKERS', 1))
+
+def on_starting(server):
+    # Create or migrate the schema once, before any worker takes a request
+    from database import ensure_schema
+    ensure_schema()
+
+def post_fork(server, worker):
+    # Threads don't survive fork(), so job workers are started in each worker process
+    if job_workers:
+        from job_queue import JobWorkerPool
+        worker.job_worker_pool = JobWorkerPool(job_workers)
+        worker.job_worker_pool.start()
+
+def worker_exit(server, worker):
+    pool = getattr(worker, 'job_worker_pool', None)
+    if pool is not None:
+        pool.stop(timeout=graceful_timeout)
@@ -0,0 +1,215 @@
+"""
+Durable background job queue stored in the SQLite database.
+
+Request handlers enqueue() jobs inside their own transaction, so a job exists
+if and only if the change that caused it was committed. Worker threads
+(JobWorkerPool, or `python tasks.py` as a separate process) claim jobs,
+run the handler registered for the job's kind and record the outcome.
+Failed jobs are retried with exponential backoff up to their max_attempts;
+handlers must therefore be idempotent. Handlers registered with `every=`
+are recurring: one job of their kind is always waiting for its next run.
+"""
+import json
+import threading
+import traceback
+from database import ensure_schema, get_db_connection, transaction
+
+# How long a claimed job is reserved for its worker. A job whose worker died
+# is claimed again once its lease runs out.
+JOB_LEASE_SECONDS = 60
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2 # seconds, doubled on every attempt
+RETRY_MAX_DELAY = 300
+# How often idle workers look for jobs enqueued by other processes
+POLL_INTERVAL = 1.0
+DEFAULT_WORKERS = 2
+
+# Job handlers by kind, registered with @job_handler
+HANDLERS = {}
+# Seconds between runs of recurring jobs, by kind
+RECURRING = {}
+
+# Set to wake idle workers in this process as soon as a job is committed
+_wake = threading.Event()
+
+def job_handler(kind, every=None):
+    """
+    Registers a function as the handler for jobs of the given kind.
+    It is called as handler(conn, payload) and may return a JSON-serializable result.
+    With `every` (seconds), the job recurs: workers make sure one is queued,
+    and each run queues the next one.
+    """
+    def register(func):
+        HANDLERS[kind] = func
+        if every:
+            RECURRING[kind] = every
+        return func
+    return register
+
+def enqueue(conn, kind, payload, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Adds a job to the queue and returns its id.
+    Call inside the transaction making the change the job follows up on,
+    then notify() once it has committed.
+    """
+    cursor = conn.execute(
+        "INSERT INTO jobs (kind, payload, max_attempts) VALUES (?, ?, ?)",
+        (kind, json.dumps(payload), max_attempts)
+    )
+    return cursor.lastrowid
+
+def enqueue_many(conn, kind, payloads, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Adds a job for each payload in one statement, e.g. for a batch of imported rows."""
+    conn.executemany(
+        "INSERT INTO jobs (kind, payload, max_attempts) VALUES (?, ?, ?)",
+        [(kind, json.dumps(payload), max_attempts) for payload in payloads]
+    )
+
+def _schedule_recurring(conn, kind, delay, current_job_id=None):
+    """Queues the next run of a recurring job unless one is already waiting (in any process)."""
+    waiting = conn.execute(
+        "SELECT 1 FROM jobs WHERE kind = ? AND status IN ('queued', 'running') AND id IS NOT ? LIMIT 1",
+        (kind, current_job_id)
+    ).fetchone()
+    if waiting is None:
+        conn.execute(
+            "INSERT INTO jobs (kind, payload, max_attempts, run_after) VALUES (?, '{}', ?, datetime('now', ?))",
+            (kind, DEFAULT_MAX_ATTEMPTS, f"+{delay} seconds")
+        )
+
+def schedule_recurring_jobs(conn):
+    """Makes sure every recurring job has a run queued; the first runs straight away."""
+    if not RECURRING:
+        return
+    with transaction(conn):
+        for kind in RECURRING:
+            _schedule_recurring(conn, kind, 0)
+
+def notify():
+    """Wakes idle workers in this process to pick up newly committed jobs."""
+    _wake.set()
+
+def get_job(conn, job_id):
+    """Returns a job's row, or None."""
+    return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+def claim_next_job(conn):
+    """
+    Reserves the oldest job that is due (or whose worker's lease has expired)
+    and returns its row, or None if there is nothing to do.
+    """
+    with transaction(conn):
+        # Jobs whose worker died on their last attempt are not retried
+        conn.execute('''
+            UPDATE jobs
+            SET status = 'failed', locked_until = NULL, updated_at = CURRENT_TIMESTAMP,
+                last_error = COALESCE(last_error, 'Worker stopped before the job finished')
+            WHERE status = 'running' AND locked_until < CURRENT_TIMESTAMP AND attempts >= max_attempts
+        ''')
+        job = conn.execute('''
+            SELECT * FROM jobs
+            WHERE (status = 'queued' AND run_after <= CURRENT_TIMESTAMP)
+               OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP)
+            ORDER BY id
+            LIMIT 1
+        ''').fetchone()
+        if job is None:
+            return None
+        conn.execute('''
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1,
+                locked_until = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (f"+{JOB_LEASE_SECONDS} seconds", job['id']))
+    return get_job(conn, job['id'])
+
+def run_job(conn, job):
+    """Runs a claimed job and records whether it succeeded, will be retried or has failed."""
+    handler = HANDLERS.get(job['kind'])
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+        result = handler(conn, json.loads(job['payload']))
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        if job['attempts'] < job['max_attempts']:
+            delay = min(RETRY_BASE_DELAY * (2 ** (job['attempts'] - 1)), RETRY_MAX_DELAY)
+            status, run_after = 'queued', f"+{delay} seconds"
+            print(f"Job {job['id']} ({job['kind']}) failed, retrying in {delay}s: {error}")
+        else:
+            status, run_after = 'failed', '+0 seconds'
+            print(f"Job {job['id']} ({job['kind']}) failed permanently: {error}")
+        with transaction(conn):
+            conn.execute('''
+                UPDATE jobs
+                SET status = ?, run_after = datetime('now', ?), locked_until = NULL,
+                    last_error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, run_after, error, job['id']))
+            if status == 'failed' and job['kind'] in RECURRING:
+                _schedule_recurring(conn, job['kind'], RECURRING[job['kind']], job['id'])
+        return False
+
+    with transaction(conn):
+        conn.execute('''
+            UPDATE jobs
+            SET status = 'done', result = ?, locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (json.dumps(result), job['id']))
+        if job['kind'] in RECURRING:
+            _schedule_recurring(conn, job['kind'], RECURRING[job['kind']], job['id'])
+    return True
+
+def run_pending_jobs(conn):
+    """Runs jobs until none are due. Returns how many were run."""
+    count = 0
+    while True:
+        job = claim_next_job(conn)
+        if job is None:
+            return count
+        run_job(conn, job)
+        count += 1
+
+class JobWorkerPool:
+    """Background threads that run queued jobs, each with its own database connection."""
+
+    def __init__(self, size=DEFAULT_WORKERS, poll_interval=POLL_INTERVAL):
+        self.size = size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        conn = get_db_connection()
+        scheduled = False
+        try:
+            while not self._stop.is_set():
+                try:
+                    ensure_schema() # Workers may start before the first request has checked it
+                    if not scheduled:
+                        schedule_recurring_jobs(conn)
+                        scheduled = True
+                    ran = run_pending_jobs(conn)
+                except Exception as e: # Keep the worker alive through e.g. a locked database
+                    print(f"Job worker error: {e}")
+                    ran = 0
+                if not ran:
+                    _wake.wait(self.poll_interval)
+                    _wake.clear()
+        finally:
+            conn.close()
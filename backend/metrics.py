@@ -0,0 +1,212 @@
+"""
+In-process performance metrics, exposed in the Prometheus text format at /metrics.
+
+- Request latency per route, and the number of SQL statements and time spent
+  in SQL per request (init_app() installs the Flask hooks)
+- Latency of every SQL statement by operation, through TimedConnection,
+  the connection class used by database.get_db_connection()
+- Latency of filesystem operations on resumes (timed() / timed_function())
+
+Metrics are kept per process: with several server processes, scrape each one.
+"""
+import bisect
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, request
+
+METRIC_PREFIX = 'referral_game_'
+
+# Upper bounds (seconds, or statements) of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# SQL statements are labelled by their leading keyword; anything else is 'OTHER'
+SQL_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'BEGIN', 'COMMIT', 'ROLLBACK', 'WITH', 'PRAGMA', 'CREATE', 'ALTER'}
+
+# Every metric, in the order they are rendered
+REGISTRY = []
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of labels."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {} # label values -> [count per bucket (last is +Inf), sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class CallbackMetric:
+    """
+    A gauge or counter whose values are read when the metrics are rendered,
+    e.g. from a cache's own counters. The callback returns {label values: value}.
+    """
+
+    def __init__(self, name, help_text, metric_type, label_names, callback):
+        self.name = METRIC_PREFIX + name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.label_names = tuple(label_names)
+        self.callback = callback
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', "Time to handle a request, by route.",
+    ('method', 'route', 'status')
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', "SQL statements run while handling a request, by route.",
+    ('route',), COUNT_BUCKETS
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'http_request_sql_duration_seconds', "Time spent running SQL while handling a request, by route.",
+    ('route',)
+)
+SQL_SECONDS = Histogram(
+    'sql_statement_duration_seconds', "Time to run an SQL statement (or commit), by operation.",
+    ('operation',), FAST_BUCKETS
+)
+FS_SECONDS = Histogram(
+    'fs_operation_duration_seconds', "Time taken by a filesystem operation on resumes, by operation.",
+    ('operation',), FAST_BUCKETS
+)
+
+# SQL totals of the request being handled by the current thread
+_request_sql = threading.local()
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def _record_sql(sql, elapsed):
+    operation = sql.lstrip()[:8].split(None, 1)[0].upper() if sql.strip() else 'OTHER'
+    SQL_SECONDS.observe(elapsed, operation if operation in SQL_OPERATIONS else 'OTHER')
+    if getattr(_request_sql, 'active', False):
+        _request_sql.statements += 1
+        _request_sql.seconds += elapsed
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that records how long each statement and commit takes."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record_sql('COMMIT', time.perf_counter() - start)
+
+    def rollback(self):
+        start = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            _record_sql('ROLLBACK', time.perf_counter() - start)
+
+@contextmanager
+def timed(operation):
+    """Records how long the block takes as a filesystem operation."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        FS_SECONDS.observe(time.perf_counter() - start, operation)
+
+def timed_function(operation):
+    """Decorator recording each call of a function as a filesystem operation."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def init_app(app):
+    """Records the latency and SQL use of every request the Flask app handles."""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        _request_sql.active = True
+        _request_sql.statements = 0
+        _request_sql.seconds = 0.0
+
+    @app.after_request
+    def record_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exception):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        # The rule, not the URL, so resume paths and ids don't each get their own series
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = g.pop('metrics_status', 500)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route, str(status))
+        REQUEST_SQL_STATEMENTS.observe(_request_sql.statements, route)
+        REQUEST_SQL_SECONDS.observe(_request_sql.seconds, route)
+        _request_sql.active = False
@@ -0,0 +1,214 @@
+import argparse
+import hashlib
+import os
+import re
+import shutil
+from database import ensure_schema, get_db_connection, on_commit, on_rollback, transaction
+import job_queue
+from metrics import timed_function
+
+# Base upload directory (REFERRAL_GAME_UPLOADS overrides, like REFERRAL_GAME_DB)
+UPLOAD_BASE_FOLDER = os.environ.get('REFERRAL_GAME_UPLOADS', os.path.join(os.path.dirname(__file__), 'uploads'))
+# Content-addressed resume files: blobs/<hash[:2]>/<hash[2:4]>/<hash>.<ext>
+BLOBS_FOLDER_NAME = 'blobs'
+BLOBS_FOLDER = os.path.join(UPLOAD_BASE_FOLDER, BLOBS_FOLDER_NAME)
+# Uploads being received; on the same filesystem as the blobs so they can be renamed into place
+STAGING_FOLDER_NAME = 'staging'
+STAGING_FOLDER = os.path.join(UPLOAD_BASE_FOLDER, STAGING_FOLDER_NAME)
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Leading bytes ("magic numbers") of each supported format.
+# DOC files are OLE2 compound documents and DOCX files are ZIP archives.
+FILE_SIGNATURES = {
+    'pdf': b'%PDF-',
+    'doc': b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',
+    'docx': b'PK\x03\x04',
+}
+SNIFF_LENGTH = max(len(signature) for signature in FILE_SIGNATURES.values())
+
+def sniff_file_type(header):
+    """
+    Returns the resume format ('pdf', 'doc' or 'docx') that the leading bytes
+    of a file belong to, or None if they match none of them.
+    """
+    for file_type, signature in FILE_SIGNATURES.items():
+        if header.startswith(signature):
+            return file_type
+    return None
+
+BLOB_PATH_PATTERN = re.compile(rf"^{BLOBS_FOLDER_NAME}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/(?P<sha256>[0-9a-f]{{64}})\.\w+$")
+
+def blob_relative_path(sha256, extension):
+    """
+    Returns the path of a resume blob relative to UPLOAD_BASE_FOLDER.
+    Two levels of hash-prefix directories keep each directory small.
+    Always uses '/' so the path can be stored in the database and used in URLs as is.
+    """
+    return f"{BLOBS_FOLDER_NAME}/{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}"
+
+def blob_sha256(relative_path):
+    """Returns the content hash of a blob from its relative path, or None if it isn't a blob path."""
+    match = BLOB_PATH_PATTERN.match(relative_path)
+    return match.group('sha256') if match else None
+
+def blob_absolute_path(relative_path):
+    return os.path.join(UPLOAD_BASE_FOLDER, *relative_path.split('/'))
+
+@timed_function('blob_store')
+def add_blob(conn, staged_path, sha256, extension, size):
+    """
+    Stores a staged file under its content hash and takes a reference to it.
+    If the same content is already stored, the staged file is deleted instead,
+    once the reference is committed. Returns the blob's relative path.
+    Must run inside transaction(), which serializes concurrent uploads of the
+    same content. If it rolls back, the reference is rolled back and the file
+    is moved back to where it was staged.
+    """
+    relative_path = blob_relative_path(sha256, extension)
+    absolute_path = blob_absolute_path(relative_path)
+    conn.execute('''
+        INSERT INTO resume_blobs (sha256, extension, size, ref_count) VALUES (?, ?, ?, 1)
+        ON CONFLICT(sha256) DO UPDATE SET ref_count = ref_count + 1
+    ''', (sha256, extension, size))
+    if os.path.exists(absolute_path):
+        on_commit(conn, lambda: os.remove(staged_path)) # Duplicate upload: keep the stored copy
+    else:
+        os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+        os.replace(staged_path, absolute_path)
+        # Undone before the write lock is released, so no other upload can have found it in the meantime
+        on_rollback(conn, lambda: os.replace(absolute_path, staged_path))
+    return relative_path
+
+@timed_function('blob_release')
+def release_blob(conn, sha256):
+    """
+    Drops a reference to a blob, deleting the blob once nothing refers to it.
+    Must run inside transaction(): the file is moved aside at once, so no
+    upload can take a new reference to it, and deleted when the transaction
+    commits (or moved back if it rolls back).
+    """
+    row = conn.execute("SELECT extension, ref_count FROM resume_blobs WHERE sha256 = ?", (sha256,)).fetchone()
+    if row is None:
+        return
+    if row['ref_count'] > 1:
+        conn.execute("UPDATE resume_blobs SET ref_count = ref_count - 1 WHERE sha256 = ?", (sha256,))
+        return
+    conn.execute("DELETE FROM resume_blobs WHERE sha256 = ?", (sha256,))
+    absolute_path = blob_absolute_path(blob_relative_path(sha256, row['extension']))
+    if os.path.exists(absolute_path):
+        # In the staging folder, so the 'expire_uploads' job clears it if this process dies first
+        released_path = os.path.join(STAGING_FOLDER, f"released_{sha256}.part")
+        os.makedirs(STAGING_FOLDER, exist_ok=True)
+        os.replace(absolute_path, released_path)
+        _remove_empty_shards(absolute_path)
+        on_rollback(conn, lambda: _restore_released(released_path, absolute_path))
+        on_commit(conn, lambda: os.remove(released_path))
+
+def _remove_empty_shards(blob_path):
+    """
+    Removes a blob's hash-prefix directories if nothing else is left in them.
+    Best effort; runs under the write lock, so no upload is adding a blob there meanwhile.
+    """
+    shard = os.path.dirname(blob_path)
+    for directory in (shard, os.path.dirname(shard)):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return # Not empty (or already gone)
+
+def _restore_released(released_path, blob_path):
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(released_path, blob_path)
+
+def hash_file(path):
+    """Returns the SHA-256 hex digest and size of a file."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def migrate_legacy_resumes(conn, dry_run=False):
+    """
+    Moves resumes referenced by students.resume_path from the legacy
+    temp_resumes/qualified_resumes/unqualified_resumes folders into the
+    content-addressed store and points the rows at their blobs.
+    Each student is migrated in its own transaction and the legacy file is only
+    removed after the row is committed, so the migration can be re-run safely.
+    Returns counts of migrated, deduplicated and missing resumes.
+    """
+    counts = {'migrated': 0, 'deduplicated': 0, 'missing': 0}
+    seen = set() # Hashes handled in this run (a dry run doesn't create blobs to find)
+    rows = conn.execute(
+        "SELECT id, resume_path FROM students WHERE resume_path NOT LIKE ?",
+        (f"{BLOBS_FOLDER_NAME}/%",)
+    ).fetchall()
+
+    for row in rows:
+        # Older rows were written on Windows with '\' separators
+        legacy_relative_path = row['resume_path'].replace('\\', '/')
+        legacy_path = os.path.join(UPLOAD_BASE_FOLDER, *legacy_relative_path.split('/'))
+        if os.path.isabs(legacy_relative_path) or not os.path.isfile(legacy_path):
+            print(f"Warning: resume for student {row['id']} not found: {row['resume_path']}")
+            counts['missing'] += 1
+            continue
+
+        sha256, size = hash_file(legacy_path)
+        # Named by what the file is, like uploads, so the same content always has the same blob path.
+        # Files of no supported type can't be uploaded, so they keep their own extension.
+        with open(legacy_path, 'rb') as f:
+            extension = sniff_file_type(f.read(SNIFF_LENGTH)) \
+                or os.path.splitext(legacy_path)[1].lstrip('.').lower()
+        relative_path = blob_relative_path(sha256, extension)
+        absolute_path = blob_absolute_path(relative_path)
+        duplicate = sha256 in seen or os.path.exists(absolute_path)
+        seen.add(sha256)
+        if dry_run:
+            counts['deduplicated' if duplicate else 'migrated'] += 1
+            continue
+
+        with transaction(conn):
+            if not duplicate:
+                # Link rather than move, so the legacy file survives a failed commit
+                os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+                try:
+                    os.link(legacy_path, absolute_path)
+                except OSError:
+                    shutil.copy2(legacy_path, absolute_path)
+                on_rollback(conn, lambda: os.remove(absolute_path))
+            conn.execute('''
+                INSERT INTO resume_blobs (sha256, extension, size, ref_count) VALUES (?, ?, ?, 1)
+                ON CONFLICT(sha256) DO UPDATE SET ref_count = ref_count + 1
+            ''', (sha256, extension, size))
+            conn.execute(
+                "UPDATE students SET resume_path = ?, resume_sha256 = ? WHERE id = ?",
+                (relative_path, sha256, row['id'])
+            )
+            job_queue.enqueue(conn, 'index_resume', {"studentId": row['id']})
+        os.remove(legacy_path)
+        counts['deduplicated' if duplicate else 'migrated'] += 1
+
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the content-addressed resume store.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subcommands.add_parser(
+        'migrate',
+        help="move resumes from temp_resumes/qualified_resumes/unqualified_resumes into the store"
+    )
+    migrate_parser.add_argument('--dry-run', action='store_true', help="report what would be migrated without changing anything")
+    args = parser.parse_args()
+
+    ensure_schema()
+    conn = get_db_connection()
+    try:
+        counts = migrate_legacy_resumes(conn, dry_run=args.dry_run)
+    finally:
+        conn.close()
+    prefix = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{prefix} {counts['migrated']} resumes, {counts['deduplicated']} duplicates of stored resumes; "
+          f"{counts['missing']} resumes not found.")
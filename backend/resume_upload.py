@@ -0,0 +1,352 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from database import transaction
+from metrics import timed
+from resume_store import SNIFF_LENGTH, add_blob, hash_file, sniff_file_type
+
+# Largest resume accepted, whether sent in one request or in chunks
+MAX_RESUME_SIZE = 20 * 1024 * 1024 # 20 MB
+# Largest body accepted for one chunk of a resumable upload
+MAX_CHUNK_SIZE = 5 * 1024 * 1024 # 5 MB
+# Size of the reads used when copying a request body to disk
+STREAM_CHUNK_SIZE = 64 * 1024
+# How long a request may take to write one chunk before another request may
+# take over the upload (e.g. when the first client went away mid-chunk)
+CHUNK_LEASE_SECONDS = 300
+# Resumable uploads not completed within this long are deleted by the
+# 'expire_uploads' job, along with anything else this old left in the staging folder
+UPLOAD_TTL_SECONDS = 24 * 60 * 60
+
+def file_extension(filename):
+    """Returns the lower-cased extension of a filename without the dot ('' if none)."""
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+class StreamingResume:
+    """
+    Writable file that stores an upload directly on disk while it is received,
+    hashing it, remembering its leading bytes and enforcing MAX_RESUME_SIZE
+    as it goes, so the body is only ever written once.
+    The file is staged as '<name>.part' on the same filesystem as the resume
+    store; claim() renames it into the store and discard() deletes it.
+    """
+
+    def __init__(self, folder, max_size=MAX_RESUME_SIZE):
+        self.staging_path = os.path.join(folder, f"upload_{os.urandom(8).hex()}.part")
+        self.max_size = max_size
+        self.size = 0
+        self.header = b''
+        self._hash = hashlib.sha256()
+        self._file = open(self.staging_path, 'w+b')
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    @property
+    def file_type(self):
+        return sniff_file_type(self.header)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        if len(self.header) < SNIFF_LENGTH:
+            self.header += data[:SNIFF_LENGTH - len(self.header)]
+        self._hash.update(data)
+        with timed('upload_write'):
+            return self._file.write(data)
+
+    # The multipart parser rewinds the stream once the part is complete;
+    # the rest of the file API is delegated to the underlying file.
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def claim(self, conn):
+        """
+        Closes the file and moves it into the resume store (a rename, not a copy).
+        Returns the stored resume's relative path. Must run inside transaction();
+        if it rolls back, the file is left staged for discard().
+        """
+        self._file.close()
+        return add_blob(conn, self.staging_path, self.sha256, self.file_type, self.size)
+
+    def discard(self):
+        """Closes and deletes the file, unless claim() has moved it into the store."""
+        self._file.close()
+        if os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+
+class _DiscardedUpload:
+    """Sink for uploads with a disallowed extension: nothing is written to disk."""
+
+    def write(self, data):
+        return len(data)
+
+    def seek(self, *args):
+        return 0
+
+    def read(self, *args):
+        return b''
+
+    def close(self):
+        pass
+
+class ResumeUploadRequest(Request):
+    """
+    Request class that streams uploaded files straight into the staging folder
+    (app.config['RESUME_UPLOAD_FOLDER']) instead of letting Werkzeug spool them
+    to a temporary file first.
+    Streams that a handler does not claim are removed by discard_uploads().
+    Views that take other kinds of files set `accepts_any_file = True`.
+    """
+
+    @property
+    def max_content_length(self):
+        """
+        The app-wide MAX_CONTENT_LENGTH, unless the view handling this request
+        sets its own limit with a `max_content_length` attribute.
+        """
+        view = current_app.view_functions.get(self.endpoint)
+        return getattr(view, 'max_content_length', None) or super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        view = current_app.view_functions.get(self.endpoint)
+        if getattr(view, 'accepts_any_file', False):
+            # e.g. manifests and zip archives: let Werkzeug spool them as usual
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        allowed_extensions = current_app.config['ALLOWED_EXTENSIONS']
+        if not filename or file_extension(filename) not in allowed_extensions:
+            return _DiscardedUpload()
+        stream = StreamingResume(current_app.config['RESUME_UPLOAD_FOLDER'])
+        self.__dict__.setdefault('resume_streams', []).append(stream)
+        return stream
+
+    def discard_uploads(self):
+        for stream in self.__dict__.pop('resume_streams', []):
+            stream.discard()
+
+class ChunkedUpload:
+    """
+    Resumable upload of a single resume sent as a series of chunks, in order.
+    Progress is tracked in the resume_uploads table and the bytes received so
+    far are kept in '<upload id>.part' inside `folder`, so an interrupted
+    upload can continue from the last byte the server has.
+    A chunk is written as reserve(), append(), then save(): the reservation
+    is a lease on the upload row, so only one request writes to the part file
+    at a time, however many retries of the same chunk arrive at once.
+    """
+
+    # Running hashes of uploads in progress, keyed by upload id, as of the last
+    # saved offset: (offset, digest, time saved). If a chunk arrives at a process
+    # that has no running hash (e.g. after a restart), the bytes already on disk
+    # are hashed once to rebuild it. Entries of uploads that stopped receiving
+    # chunks are dropped after UPLOAD_TTL_SECONDS.
+    _hashes = {}
+    _hashes_lock = threading.Lock()
+
+    def __init__(self, row, folder):
+        self.id = row['id']
+        self.filename = row['filename']
+        self.size = row['size']
+        self.received = row['received']
+        self.sha256 = row['sha256']
+        self.staging_path = os.path.join(folder, f"{self.id}.part")
+        self._previous_received = self.received
+        self._lease = None
+        self._digest = None
+        self._verified = None
+
+    @classmethod
+    def create(cls, conn, folder, filename, size):
+        """Starts a new upload session and its empty part file."""
+        upload_id = os.urandom(16).hex()
+        conn.execute(
+            "INSERT INTO resume_uploads (id, filename, size) VALUES (?, ?, ?)",
+            (upload_id, filename, size)
+        )
+        open(os.path.join(folder, f"{upload_id}.part"), 'wb').close()
+        return cls.load(conn, folder, upload_id)
+
+    @classmethod
+    def load(cls, conn, folder, upload_id):
+        """Returns the upload session with the given id, or None."""
+        row = conn.execute("SELECT * FROM resume_uploads WHERE id = ?", (upload_id,)).fetchone()
+        return cls(row, folder) if row else None
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    @property
+    def file_type(self):
+        with open(self.staging_path, 'rb') as f:
+            return sniff_file_type(f.read(SNIFF_LENGTH))
+
+    def _running_hash(self):
+        """Returns a digest of the bytes up to the current offset, private to this request."""
+        with self._hashes_lock:
+            running = self._hashes.get(self.id)
+            if running is not None and running[0] == self.received:
+                return running[1].copy()
+        digest = hashlib.sha256()
+        with open(self.staging_path, 'rb') as f:
+            remaining = self.received
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+        return digest
+
+    def reserve(self, conn):
+        """
+        Takes the lease for writing the chunk at the current offset. Returns False
+        if another request holds it or has already moved the upload on.
+        The lease runs out after CHUNK_LEASE_SECONDS, so an upload whose writer
+        died can be continued. Must run inside a write transaction.
+        """
+        # The expiry, to the microsecond, also identifies this request's lease
+        lease = (datetime.now(timezone.utc) + timedelta(seconds=CHUNK_LEASE_SECONDS)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        cursor = conn.execute('''
+            UPDATE resume_uploads SET locked_until = ?
+            WHERE id = ? AND received = ? AND (locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP)
+        ''', (lease, self.id, self.received))
+        if cursor.rowcount != 1:
+            return False
+        self._lease = lease
+        return True
+
+    def release(self, conn):
+        """Gives up the lease without moving the offset, e.g. after an incomplete chunk."""
+        conn.execute(
+            "UPDATE resume_uploads SET locked_until = NULL WHERE id = ? AND locked_until = ?",
+            (self.id, self._lease)
+        )
+        self._lease = None
+
+    def append(self, stream, length):
+        """
+        Appends `length` bytes read from `stream` at the current offset.
+        Returns False (leaving the offset unchanged) if the stream ends early.
+        Call reserve() first, and save() afterwards to record the new offset.
+        """
+        digest = self._running_hash()
+        self._previous_received = self.received
+        with open(self.staging_path, 'r+b') as f:
+            f.truncate(self.received) # Drop any bytes left behind by an interrupted chunk
+            f.seek(self.received)
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                with timed('chunk_write'):
+                    f.write(chunk)
+                digest.update(chunk)
+                remaining -= len(chunk)
+        if remaining:
+            return False # The client went away mid-chunk
+        self.received += length
+        self._digest = digest
+        if self.complete:
+            self.sha256 = digest.hexdigest()
+        return True
+
+    def save(self, conn):
+        """
+        Records the offset reached by append() and gives up the lease. Returns
+        False if the lease ran out and another request took the upload over.
+        """
+        cursor = conn.execute('''
+            UPDATE resume_uploads SET received = ?, sha256 = ?, locked_until = NULL
+            WHERE id = ? AND received = ? AND locked_until = ?
+        ''', (self.received, self.sha256, self.id, self._previous_received, self._lease))
+        if cursor.rowcount != 1:
+            return False
+        now = time.monotonic()
+        with self._hashes_lock:
+            if self.complete:
+                self._hashes.pop(self.id, None)
+            else:
+                self._hashes[self.id] = (self.received, self._digest, now)
+            # Abandoned uploads are only deleted from the database by the 'expire_uploads'
+            # job, which may run in another process
+            for upload_id, (_, _, saved_at) in list(self._hashes.items()):
+                if now - saved_at > UPLOAD_TTL_SECONDS:
+                    del self._hashes[upload_id]
+        return True
+
+    @classmethod
+    def forget(cls, upload_ids):
+        """Drops the running hashes this process holds for uploads that no longer exist."""
+        with cls._hashes_lock:
+            for upload_id in upload_ids:
+                cls._hashes.pop(upload_id, None)
+
+    def verify(self):
+        """
+        Hashes the completed file again, so the store's hash always matches
+        what is on disk, and sniffs its type. Reads the whole file, so call it
+        before the write transaction that claims the upload, not inside it:
+        a complete upload can't change any more. Returns the file type.
+        """
+        sha256, size = hash_file(self.staging_path)
+        if sha256 != self.sha256:
+            print(f"Warning: upload {self.id} was recorded with hash {self.sha256} but its contents hash to {sha256}")
+        self._verified = (self.sha256, sha256, size, self.file_type)
+        return self._verified[3]
+
+    def claim(self, conn):
+        """
+        Moves the file checked by verify() into the resume store and ends the
+        session. Returns the stored resume's relative path, or None if the
+        upload was claimed or expired since it was verified.
+        Must run inside a write transaction.
+        """
+        recorded_sha256, sha256, size, file_type = self._verified
+        row = conn.execute(
+            "SELECT sha256 FROM resume_uploads WHERE id = ? AND received = size", (self.id,)
+        ).fetchone()
+        if row is None or row['sha256'] != recorded_sha256:
+            return None
+        self.sha256 = sha256
+        relative_path = add_blob(conn, self.staging_path, sha256, file_type, size)
+        conn.execute("DELETE FROM resume_uploads WHERE id = ?", (self.id,))
+        return relative_path
+
+def expire_uploads(conn, folder, ttl=UPLOAD_TTL_SECONDS):
+    """
+    Deletes resumable uploads started more than `ttl` seconds ago, and every
+    file in the staging folder that hasn't been written to for that long and
+    doesn't belong to an upload still in progress (abandoned part files,
+    files left behind by a crashed process).
+    Returns counts of expired uploads and removed files.
+    """
+    with transaction(conn):
+        expired_ids = [row['id'] for row in conn.execute(
+            "SELECT id FROM resume_uploads WHERE created_at < datetime('now', ?)", (f"-{ttl} seconds",)
+        )]
+        conn.executemany("DELETE FROM resume_uploads WHERE id = ?", [(upload_id,) for upload_id in expired_ids])
+        in_progress = {f"{row['id']}.part" for row in conn.execute("SELECT id FROM resume_uploads")}
+
+    ChunkedUpload.forget(expired_ids)
+
+    removed = 0
+    cutoff = time.time() - ttl
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name in in_progress or not entry.is_file(follow_symlinks=False):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass # Claimed or discarded in the meantime
+    return {"expiredUploads": len(expired_ids), "removedFiles": removed}
@@ -0,0 +1,231 @@
+"""
+Full-text search over student names and the contents of their resumes.
+
+Text is extracted from each distinct resume (by content hash) once, in a pool
+of worker processes so parsing a large PDF never blocks a web or job worker
+thread, and cached in resume_texts. A parse that hangs or kills its process
+only costs that pool: its workers are killed and the next extraction starts
+a new one. Every student has a row in the
+student_search FTS5 index holding their name and their resume's text;
+index_student() (run by the 'index_resume' background job) refreshes it.
+"""
+import argparse
+import html
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+from database import ensure_schema, get_db_connection, transaction
+from job_queue import JOB_LEASE_SECONDS
+from resume_store import blob_absolute_path
+
+try:
+    import pypdf # Optional: without it, PDF resumes are searchable by name only
+except ImportError:
+    pypdf = None
+
+# Processes extracting resume text (EXTRACT_WORKERS overrides)
+DEFAULT_EXTRACT_WORKERS = 2
+# Give up on (and retry later) a resume that takes longer than this to parse.
+# Well inside the job lease, so a slow parse's job isn't claimed again meanwhile.
+EXTRACT_TIMEOUT = JOB_LEASE_SECONDS // 2
+# Extractor processes are started from a clean server process rather than
+# forked from a threaded web or job worker (fork copies locks held by other threads)
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# Text kept per resume; anything past this is not searchable
+MAX_TEXT_LENGTH = 200_000
+
+# Relative weights of the first_name, last_name and resume_text columns in the ranking
+RANK_WEIGHTS = (10.0, 10.0, 1.0)
+RANK_EXPRESSION = f"bm25(student_search, {', '.join(str(weight) for weight in RANK_WEIGHTS)})"
+# Words of context around the matches in each snippet
+SNIPPET_TOKENS = 24
+# Control characters mark the matches in snippets, so they can be turned into
+# <mark> tags after the rest of the snippet has been HTML-escaped
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+WORDPROCESSINGML_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def extract_text(path, extension):
+    """
+    Returns the plain text of a resume file. Runs in an extractor process.
+    DOC files and damaged files have no text (''); PDFs can't be read while
+    pypdf isn't installed (None), so they are extracted again once it is.
+    """
+    if extension == 'pdf' and pypdf is None:
+        return None
+    try:
+        if extension == 'docx':
+            return _extract_docx_text(path)[:MAX_TEXT_LENGTH]
+        if extension == 'pdf':
+            return _extract_pdf_text(path)[:MAX_TEXT_LENGTH]
+    except Exception as e: # Parsers raise all sorts of errors on damaged files
+        print(f"Warning: could not extract text from {path}: {e}")
+    return ''
+
+def _extract_pdf_text(path):
+    pages = []
+    length = 0
+    for page in pypdf.PdfReader(path).pages:
+        pages.append(page.extract_text() or '')
+        length += len(pages[-1])
+        if length >= MAX_TEXT_LENGTH:
+            break
+    return '\n'.join(pages)
+
+def _extract_docx_text(path):
+    """Reads the paragraphs of a DOCX file's main document part, streaming the XML."""
+    paragraphs = []
+    words = []
+    length = 0
+    with zipfile.ZipFile(path) as docx, docx.open('word/document.xml') as document:
+        for _, element in ElementTree.iterparse(document):
+            if element.tag == f"{WORDPROCESSINGML_NS}t" and element.text:
+                words.append(element.text)
+            elif element.tag == f"{WORDPROCESSINGML_NS}tab":
+                words.append(' ')
+            elif element.tag == f"{WORDPROCESSINGML_NS}p":
+                paragraphs.append(''.join(words))
+                length += len(paragraphs[-1])
+                words = []
+                if length >= MAX_TEXT_LENGTH:
+                    break
+                element.clear() # Keep memory flat on long documents
+    return '\n'.join(paragraphs)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                int(os.environ.get('EXTRACT_WORKERS', DEFAULT_EXTRACT_WORKERS)),
+                mp_context=multiprocessing.get_context(START_METHOD)
+            )
+        return _executor
+
+def _discard_executor(executor):
+    """
+    Replaces a pool whose worker died or hung: kills its processes (a hung
+    parse would otherwise hold a worker for good) and lets the next
+    extraction start a fresh pool. Extractions still running in it fail and
+    are retried by their jobs.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    # ProcessPoolExecutor has no public way to stop a busy worker before Python 3.14
+    for process in list((executor._processes or {}).values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _forget_executor():
+    # A forked child can't use its parent's pool (or a lock another thread held)
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_executor)
+
+def resume_text(conn, sha256, resume_path):
+    """
+    Returns the extracted text of a resume, extracting it in the process pool
+    only if this content hasn't been seen before, or None if it can't be read yet.
+    """
+    row = conn.execute("SELECT text FROM resume_texts WHERE sha256 = ?", (sha256,)).fetchone()
+    if row is not None:
+        return row['text']
+
+    extension = os.path.splitext(resume_path)[1].lstrip('.').lower()
+    executor = _get_executor()
+    try:
+        future = executor.submit(extract_text, blob_absolute_path(resume_path), extension)
+        text = future.result(timeout=EXTRACT_TIMEOUT)
+    except (BrokenProcessPool, FutureTimeoutError):
+        _discard_executor(executor)
+        raise
+    if text is None:
+        return None
+    with transaction(conn):
+        conn.execute("INSERT OR IGNORE INTO resume_texts (sha256, text) VALUES (?, ?)", (sha256, text))
+    return text
+
+def index_student(conn, student_id):
+    """
+    Writes a student's name and resume text to the search index.
+    A resume whose content has been indexed before is not extracted again.
+    Students whose resume can't be read yet are indexed by name and picked up
+    again by reindex().
+    """
+    row = conn.execute(
+        "SELECT id, first_name, last_name, resume_path, resume_sha256 FROM students WHERE id = ?",
+        (student_id,)
+    ).fetchone()
+    if row is None:
+        return {"indexed": False, "reason": "student not found"}
+
+    # Resumes not yet moved into the content-addressed store have no hash to cache their text by
+    text = resume_text(conn, row['resume_sha256'], row['resume_path']) if row['resume_sha256'] else None
+
+    with transaction(conn):
+        conn.execute("DELETE FROM student_search WHERE rowid = ?", (student_id,))
+        conn.execute(
+            "INSERT INTO student_search (rowid, first_name, last_name, resume_text) VALUES (?, ?, ?, ?)",
+            (student_id, row['first_name'], row['last_name'], text or '')
+        )
+        conn.execute(
+            "UPDATE students SET indexed_sha256 = ? WHERE id = ?",
+            (row['resume_sha256'] if text is not None else None, student_id)
+        )
+    return {"indexed": True, "studentId": student_id, "resumeText": text is not None}
+
+def reindex(conn):
+    """
+    Indexes every student whose current resume hasn't been indexed yet (new,
+    migrated or unreadable before). Returns how many students were indexed.
+    """
+    student_ids = [row['id'] for row in conn.execute(
+        "SELECT id FROM students WHERE indexed_sha256 IS NULL OR indexed_sha256 != resume_sha256"
+    )]
+    for student_id in student_ids:
+        index_student(conn, student_id)
+    return len(student_ids)
+
+def match_expression(query):
+    """
+    Turns a search box query into an FTS5 MATCH expression: every word must
+    match, and the last word also matches as a prefix (for search-as-you-type).
+    Returns None if the query has no words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def highlight(snippet):
+    """HTML-escapes a snippet and wraps its matches in <mark> tags."""
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the resume search index.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('reindex', help="index students whose resume hasn't been indexed yet")
+    args = parser.parse_args()
+
+    ensure_schema()
+    conn = get_db_connection()
+    try:
+        count = reindex(conn)
+    finally:
+        conn.close()
+    print(f"Indexed {count} students.")
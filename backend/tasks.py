@@ -0,0 +1,40 @@
+import argparse
+import time
+from job_queue import job_handler, JobWorkerPool, DEFAULT_WORKERS
+from resume_store import STAGING_FOLDER
+import resume_upload
+import search
+
+# How often abandoned uploads are cleared out of the staging folder
+UPLOAD_EXPIRY_INTERVAL = 60 * 60 # seconds
+
+@job_handler('index_resume')
+def index_resume(conn, payload):
+    """
+    Adds a student (name and resume text) to the search index after their
+    resume was uploaded or moved. Text is only extracted for content not seen before.
+    """
+    return search.index_student(conn, payload['studentId'])
+
+@job_handler('expire_uploads', every=UPLOAD_EXPIRY_INTERVAL)
+def expire_uploads(conn, payload):
+    """
+    Deletes resumable uploads that were never completed, and files abandoned
+    in the staging folder, so unfinished uploads can't fill the disk.
+    """
+    return resume_upload.expire_uploads(conn, STAGING_FOLDER)
+
+if __name__ == '__main__':
+    # Run job workers in their own process, e.g. alongside several web server processes
+    parser = argparse.ArgumentParser(description="Run background job workers.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f"worker threads (default: {DEFAULT_WORKERS})")
+    args = parser.parse_args()
+
+    workers = JobWorkerPool(args.workers)
+    workers.start()
+    print(f"Started {args.workers} job workers. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        workers.stop()
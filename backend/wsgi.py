@@ -0,0 +1,13 @@
+"""
+Production entry point: the WSGI application for a multi-process server, e.g.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built at import time without opening the database, so gunicorn
+can import it once in the master process (preload_app) and fork workers
+that start instantly; each worker opens its own SQLite connections after
+the fork. See gunicorn.conf.py for the worker and job-worker settings.
+"""
+from app import create_app
+
+app = create_app()
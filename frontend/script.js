@@ -10,267 +10,109 @@ document.addEventListener('DOMContentLoaded', () => {
     const exceptionSuffix =
     "\n\nIs there an exception for the children of a client or employee?\n\nNo, there are no exceptions."
 
-    // Flowchart
-    const questions = [
-        {
-            id: 'q1',
-            question: "Is this person currently enrolled in school?",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: 'q2' },
-                {
-                    text: "No",
-                    score: -12,
-                    nextQuestion: null,
-                    endQuiz: true,
-                    message: "This student is not currently enrolled in school and does not meet the basic eligibility criteria for the InStep program."
-                }
-            ]
-        },
-        {
-            id: 'q2',
-            question: "Does the student have permanent US work authorization? (CPT/OPT/F1 is not permanent)",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: 'q3' },
-                { text: "No", score: -12, nextQuestion: null, endQuiz: true, message: "The InStep program requires permanent US work authorization." } // Added early exit for No
-            ]
-        },
-        {
-            id: 'q3',
-            question: "Is the student currently in their third year (junior year) of undergraduate studies?",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: 'q4' },
-                { text: "No", score: -12, nextQuestion: null, endQuiz: true, message: "The InStep program primarily targets third-year undergraduate students." } // Added early exit for No
-            ]
-        },
-        {
-            id: 'q4',
-            question: "Is the student pursuing a degree in computer science, computer engineering, data science, or some other related technical field?",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: 'q7' },
-                { text: "No", score: 1, nextQuestion: 'q5' }
-            ]
-        },
-        {
-            id: 'q5',
-            question: "Is the student pursuing a degree in Business Analytics?",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: 'q6' },
-                {
-                    text: "No",
-                    score: -12,
-                    nextQuestion: null,
-                    endQuiz: true,
-                    message: "A degree in Business Analytics is a core requirement for this InStep position to ensure alignment with the program's objectives. This student's academic background does not appear to meet that specific criterion."
-                }
-            ]
-        },
-        {
-            id: 'q6',
-            question: "Does this student live within one hour of the Hartford hub? (Hartford, Raleigh, Indianapolis, Richardson, Tempe, or Bridegewater)",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: null },
-                {
-                    text: "No",
-                    score: -12,
-                    nextQuestion: null,
-                    endQuiz: true,
-                    message: "InStep program prioritizes candidates who live within one hour of our designated hubs (Hartford, Raleigh, Indianapolis, Richardson, Tempe, or Bridgewater) to ensure a successful in-person experience."
-                }
-            ]
-        },
-        {
-            id: 'q7',
-            question: "Which University does the student attend?",
-            options: [
-                { text: "Harvard", score: 1, nextQuestion: 'q8' },
-                { text: "Stanford", score: 1, nextQuestion: 'q8' },
-                { text: "MIT", score: 1, nextQuestion: 'q8' },
-                { text: "Yale", score: 1, nextQuestion: 'q8' },
-                { text: "Princeton", score: 1, nextQuestion: 'q8' },
-                { text: "Columbia", score: 1, nextQuestion: 'q8' },
-                { text: "University of Pennsylvania", score: 1, nextQuestion: 'q8' },
-                { text: "Carnegie Mellon", score: 1, nextQuestion: 'q8' },
-                { text: "Georgia Tech", score: 1, nextQuestion: 'q8' },
-                { text: "NYU", score: 1, nextQuestion: 'q8' },
-                { text: "UT-Austin", score: 1, nextQuestion: 'q8' },
-                { text: "U-Washington (Seattle)", score: 1, nextQuestion: 'q8' },
-                { text: "UCLA", score: 1, nextQuestion: 'q8' },
-                { text: "USC", score: 1, nextQuestion: 'q8' },
-                { text: "UC-Berkeley", score: 1, nextQuestion: 'q8' },
-                { text: "Brown", score: 1, nextQuestion: 'q8' },
-                { text: "Cornell", score: 1, nextQuestion: 'q8' },
-                {
-                    text: "Other/Not Listed",
-                    score: -12,
-                    nextQuestion: null,
-                    endQuiz: true,
-                    message: "Our InStep program is specifically tailored for students attending certain academic institutions that align with our strategic recruitment goals. As this student attends a different university, they would not meet the current eligibility criteria."
-                }
-            ]
-        },
-        {
-            id: 'q8',
-            question: "Is the student a citizen of India?",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: 'q9' },
-                { text: "No", score: 1, nextQuestion: null }
-            ]
-        },
-        {
-            id: 'q9',
-            question: "Is the student currently a PhD candidate studying Computer Science, Computer Engineering, or Data Science?",
-            options: [
-                { text: "Yes", score: 1, nextQuestion: null },
-                {
-                    text: "No",
-                    score: -12,
-                    nextQuestion: null,
-                    endQuiz: true,
-                    message: "InStep program is designed for students at the PhD level in Computer Science, Computer Engineering, or Data Science. This student's current academic standing does not align with that criterion."
-                }
-            ]
-        }
-    ];
-
-    let currentQuestionIndex = 0;
-    let yesAnswersCount = 0; // This now accumulates a total score that can be positive or negative
+    // Flowchart: the question set is served (and scored) by the backend
+    const questionSetUrl = 'http://localhost:5001/api/question_sets/current';
+
+    // Resumes larger than this are uploaded in chunks, so a dropped connection
+    // only costs the current chunk instead of the whole file
+    const CHUNKED_UPLOAD_THRESHOLD = 5 * 1024 * 1024;
+    const MAX_CHUNK_ATTEMPTS = 3;
+
+    let questionSet = null; // Loaded from the backend when the quiz starts
+    let questionsById = {};
+    let currentQuestionId = null;
+    let answers = {}; // Question id -> answer text, scored by the backend
     let studentId = null; // Store the student ID received from the backend
 
+    async function loadQuestionSet() {
+        const response = await fetch(questionSetUrl);
+        if (!response.ok) {
+            throw new Error(`HTTP error! Status: ${response.status}`);
+        }
+        questionSet = await response.json();
+        questionsById = Object.fromEntries(questionSet.questions.map(q => [q.id, q]));
+    }
+
     function loadQuestion() {
-        if (currentQuestionIndex < questions.length) {
-            const q = questions[currentQuestionIndex];
-            quizContainer.innerHTML = `
-                <div class="question-card">
-                    <h3>${q.question}</h3>
-                    <div class="options-container">
-                        ${q.options.map((option, index) =>
-                            `<button
-                                data-score="${option.score}"
-                                data-next-question="${option.nextQuestion}"
-                                data-end-quiz="${option.endQuiz ? 'true' : 'false'}"
-                                data-message="${option.message || ''}"
-                            >${option.text}</button>`
-                        ).join('')}
-                    </div>
+        const q = questionsById[currentQuestionId];
+        quizContainer.innerHTML = `
+            <div class="question-card">
+                <h3>${q.question}</h3>
+                <div class="options-container">
+                    ${q.options.map((option, index) =>
+                        `<button data-option-index="${index}">${option.text}</button>`
+                    ).join('')}
                 </div>
-            `;
-            attachEventListeners();
-        } else {
-            showResults(); // After last question, show results and send assessment to backend
-        }
+            </div>
+        `;
+        attachEventListeners(q);
     }
 
-    function attachEventListeners() {
+    function attachEventListeners(q) {
         const buttons = quizContainer.querySelectorAll('.options-container button');
         buttons.forEach(button => {
             button.addEventListener('click', (event) => {
-                const score = parseInt(event.target.dataset.score);
-                const endQuiz = event.target.dataset.endQuiz === 'true'; // Check the endQuiz flag
-                const message = event.target.dataset.message; // Get the specific message
+                const option = q.options[parseInt(event.target.dataset.optionIndex)];
+                answers[q.id] = option.text;
 
-                // Accumulate score immediately
-                yesAnswersCount += score;
-
-                if (endQuiz) {
-                    endQuizEarly(message); // Pass the specific message
-                    return; // Stop further processing
+                // Follow the flowchart; an early exit or the last question ends the quiz
+                if (option.endQuiz || !option.nextQuestion) {
+                    submitAssessment();
+                    return;
                 }
-
-                currentQuestionIndex++;
+                currentQuestionId = option.nextQuestion;
                 loadQuestion();
             });
         });
     }
 
-    async function showResults() {
+    async function submitAssessment() {
         quizContainer.style.display = 'none';
-        resultsContainer.style.display = 'block';
-
-        const totalPossibleYes = questions.length; // Still useful for context if needed, but not for qualification logic
-        // The scoreOutOfTen and roundedScore are not relevant
-        const scoreOutOfTen = (yesAnswersCount / totalPossibleYes) * 10;
-        const roundedScore = Math.round(scoreOutOfTen);
-
-        let message = `Assessment complete. Your total score is: ${yesAnswersCount}. `; // Updated message to show the score
-
-        // New qualification logic: positive score for qualified, non-positive for unqualified
-        if (yesAnswersCount > 0) {
-            message += "This student appears to be a strong candidate for the InStep program and can realistically be considered!";
-            resultsContainer.style.borderColor = '#28a745';
-            resultsContainer.style.backgroundColor = '#d4edda';
-            resultsContainer.style.color = '#155724';
-        } else {
-            message += "Based on their qualifications, this program may not be a good fit for this student at this time.";
-            + exceptionSuffix;
-            resultsContainer.style.borderColor = '#dc3545';
-            resultsContainer.style.backgroundColor = '#f8d7da';
-            resultsContainer.style.color = '#721c24';
-        }
-
-        resultMessage.textContent = message;
-
-        // Send Assessment Data to Backend
-        if (studentId) { // Only send if we have a studentId
-            try {
-                const response = await fetch('http://localhost:5001/api/assessments', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        studentId: studentId,
-                        yesAnswersCount: yesAnswersCount, // Send the actual accumulated score
-                        totalPossibleYes: totalPossibleYes,
-                        assessmentMessage: message // Store the final message too
-                    })
-                });
 
-                if (!response.ok) {
-                    const errorData = await response.json(); // Try to get more detailed error from backend
-                    throw new Error(`HTTP error! status: ${response.status}, Message: ${errorData.message || response.statusText}`);
-                }
-                const result = await response.json();
-                console.log('Assessment data submitted successfully:', result);
-            } catch (error) {
-                console.error('Error submitting assessment data:', error);
-                // Using a custom modal/message box instead of alert()
-                displayMessageModal(`Failed to record assessment data: ${error.message}. Please check console for details.`);
-            }
-        } else {
+        if (!studentId) {
             console.warn("Student ID not available, assessment data not submitted.");
+            return;
         }
-    }
-
-    // Function to handle early quiz termination with a dynamic message
-    function endQuizEarly(message) {
-        quizContainer.style.display = 'none';
-        resultsContainer.style.display = 'block';
-        resultMessage.textContent = message + exceptionSuffix; // Use the passed message
-        resultsContainer.style.borderColor = '#dc3545';
-        resultsContainer.style.backgroundColor = '#f8d7da'; // Light red background
-        resultsContainer.style.color = '#721c24';
-
-        // Send a simplified assessment to the backend for early exits
-        if (studentId) {
-            fetch('http://localhost:5001/api/assessments', {
+        try {
+            const response = await fetch('http://localhost:5001/api/assessments', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
                     studentId: studentId,
-                    yesAnswersCount: yesAnswersCount, // Send the current accumulated score which will be non-positive
-                    totalPossibleYes: questions.length,
-                    assessmentMessage: message // Send the specific early exit message
+                    questionSetVersion: questionSet.version,
+                    answers: answers // Scored by the backend
                 })
-            }).then(response => {
-                if (!response.ok) {
-                    // Log error but don't block UI with an alert for early exit submissions
-                    console.error('Error submitting early assessment data:', response.status, response.statusText);
-                }
-            }).catch(error => {
-                console.error('Network error submitting early assessment data:', error);
             });
+
+            const result = await response.json();
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}, Message: ${result.message || response.statusText}`);
+            }
+            console.log('Assessment data submitted successfully:', result);
+            showResults(result);
+        } catch (error) {
+            console.error('Error submitting assessment data:', error);
+            // Using a custom modal/message box instead of alert()
+            displayMessageModal(`Failed to record assessment data: ${error.message}. Please check console for details.`);
+        }
+    }
+
+    function showResults(result) {
+        resultsContainer.style.display = 'block';
+
+        // Positive score for qualified, non-positive for unqualified
+        if (result.yesAnswersCount > 0) {
+            resultMessage.textContent = result.assessmentMessage;
+            resultsContainer.style.borderColor = '#28a745';
+            resultsContainer.style.backgroundColor = '#d4edda';
+            resultsContainer.style.color = '#155724';
+        } else {
+            resultMessage.textContent = result.assessmentMessage + exceptionSuffix;
+            resultsContainer.style.borderColor = '#dc3545';
+            resultsContainer.style.backgroundColor = '#f8d7da';
+            resultsContainer.style.color = '#721c24';
         }
     }
 
@@ -298,9 +140,55 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
 
+    // Uploads a large resume through the resumable upload API and returns its upload ID
+    async function uploadResumeInChunks(file) {
+        const uploadsUrl = 'http://localhost:5001/api/resume_uploads';
+        const createResponse = await fetch(uploadsUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        const upload = await createResponse.json();
+        if (!createResponse.ok) {
+            throw new Error(`HTTP error! Status: ${createResponse.status}, Message: ${upload.message}`);
+        }
+
+        let offset = upload.offset;
+        let failedAttempts = 0;
+        while (offset < file.size) {
+            const end = Math.min(offset + upload.maxChunkSize, file.size);
+            try {
+                const response = await fetch(`${uploadsUrl}/${upload.uploadId}`, {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Range': `bytes ${offset}-${end - 1}/${file.size}`
+                    },
+                    body: file.slice(offset, end)
+                });
+                const result = await response.json();
+                if (!response.ok) {
+                    throw new Error(`HTTP error! Status: ${response.status}, Message: ${result.message}`);
+                }
+                offset = result.offset;
+                failedAttempts = 0;
+            } catch (error) {
+                failedAttempts++;
+                if (failedAttempts >= MAX_CHUNK_ATTEMPTS) {
+                    throw error;
+                }
+                // Resume from whatever the server has actually received
+                const statusResponse = await fetch(`${uploadsUrl}/${upload.uploadId}`);
+                offset = (await statusResponse.json()).offset;
+            }
+        }
+        return upload.uploadId;
+    }
+
     function restartQuiz() {
-        currentQuestionIndex = 0;
-        yesAnswersCount = 0; // Reset score
+        currentQuestionId = null;
+        answers = {}; // Reset answers
         studentId = null; // Clear student ID on restart
         resultsContainer.style.display = 'none';
         inputFormContainer.style.display = 'none';
@@ -313,6 +201,13 @@ document.addEventListener('DOMContentLoaded', () => {
     startButton.addEventListener('click', () => {
         startContainer.style.display = 'none';
         inputFormContainer.style.display = 'block'; // Show the input form
+        // Fetch the questions while the form is being filled in
+        if (!questionSet) {
+            loadQuestionSet().catch(error => {
+                console.error('Error loading questions:', error);
+                displayMessageModal(`Failed to load the assessment questions: ${error.message}. Please reload the page.`);
+            });
+        }
     });
 
     studentDataForm.addEventListener('submit', async (event) => {
@@ -327,12 +222,22 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
+        if (!questionSet) {
+            displayMessageModal('The assessment questions have not loaded yet. Please try again in a moment.');
+            return;
+        }
+
         const formData = new FormData();
         formData.append('firstName', firstName);
         formData.append('lastName', lastName);
-        formData.append('resume', resumeFile);
 
         try {
+            if (resumeFile.size > CHUNKED_UPLOAD_THRESHOLD) {
+                formData.append('uploadId', await uploadResumeInChunks(resumeFile));
+            } else {
+                formData.append('resume', resumeFile);
+            }
+
             const response = await fetch('http://localhost:5001/api/students', {
                 method: 'POST',
                 body: formData // FormData handles multipart/form-data
@@ -350,6 +255,7 @@ document.addEventListener('DOMContentLoaded', () => {
             displayMessageModal('Student data submitted! Proceeding to assessment.');
             inputFormContainer.style.display = 'none'; // Hide the form
             quizContainer.style.display = 'block';      // Show the quiz
+            currentQuestionId = questionSet.start;
             loadQuestion();                              // Start the quiz
         } catch (error) {
             console.error('Error submitting student data:', error);